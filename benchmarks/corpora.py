@@ -0,0 +1,61 @@
+"""Synthetic caption corpora: English, Devanagari and transliterated Marathi.
+
+Captions are drawn from fixed word lists with a seeded generator, so every
+run benchmarks the same text.
+"""
+import json
+import random
+from pathlib import Path
+
+EMOTIONS_JSON = Path(__file__).resolve().parents[1] / 'src' / 'marathi_meme_generator' / 'emotions.json'
+
+ENGLISH_WORDS = {
+    'happy': ['love', 'great', 'awesome', 'happy', 'finally', 'best', 'win', 'yay'],
+    'sad': ['hate', 'terrible', 'sad', 'broken', 'worst', 'tired', 'lost', 'crying'],
+    'neutral': [
+        'when', 'the', 'build', 'passes', 'on', 'first', 'try', 'monday', 'meeting',
+        'could', 'have', 'been', 'an', 'email', 'my', 'code', 'in', 'production', 'me',
+        'waiting', 'for', 'weekend', 'deploy', 'friday', 'coffee', 'again',
+    ],
+}
+
+DEVANAGARI_WORDS = [
+    'मी', 'तू', 'आम्ही', 'आज', 'उद्या', 'खूप', 'मस्त', 'छान', 'आनंद', 'मजा', 'दुःख',
+    'राग', 'वाईट', 'प्रेम', 'सुंदर', 'काय', 'कसा', 'कुठे', 'आहे', 'नाही', 'घरी', 'जा',
+    'मित्र', 'शाळा', 'पाऊस', 'चहा', 'सोमवार', 'परीक्षा', 'सुट्टी', 'भारी', 'झाला', 'केला',
+]
+
+
+def _sentences(rng, words, count, min_words=2, max_words=12):
+    return [' '.join(rng.choice(words) for _ in range(rng.randint(min_words, max_words))) for _ in range(count)]
+
+def english(count, seed=0):
+    rng = random.Random(seed)
+    words = [word for group in ENGLISH_WORDS.values() for word in group]
+    return _sentences(rng, words, count)
+
+def devanagari(count, seed=0):
+    rng = random.Random(seed)
+    return _sentences(rng, DEVANAGARI_WORDS, count)
+
+def transliterated(count, seed=0):
+    """Marathi written in Latin script, from the word lists detect_emotion uses."""
+    rng = random.Random(seed)
+    with open(EMOTIONS_JSON, 'r', encoding='utf-8') as f:
+        emotions = json.load(f)
+    words = sorted({
+        word for emotion, group in emotions.items() if emotion != 'phrases'
+        for word in group if ' ' not in word
+    })
+    phrases = [phrase for group in emotions.get('phrases', {}).values() for phrase in group]
+    captions = _sentences(rng, words, count)
+    # Some captions carry a known phrase, as real ones do
+    for index in range(0, count, 5):
+        captions[index] = f"{captions[index]} {rng.choice(phrases)}"
+    return captions
+
+CORPORA = {
+    'english': english,
+    'devanagari': devanagari,
+    'transliterated': transliterated,
+}
@@ -0,0 +1,50 @@
+"""Synthetic source images for the benchmarks."""
+import io
+
+from PIL import Image, ImageDraw, ImageFilter
+
+# Still images as width x height, animations as (width x height, frames)
+STILL_SIZES = [(320, 240), (800, 600), (1920, 1080)]
+ANIMATIONS = [((320, 240), 20), ((480, 270), 60), ((854, 480), 120)]
+QUICK_STILL_SIZES = [(320, 240), (800, 600)]
+QUICK_ANIMATIONS = [((320, 240), 10), ((480, 270), 20)]
+
+
+def photo_background(size):
+    """Blurred noise over a gradient, which quantizes like a photo."""
+    return Image.blend(
+        Image.effect_noise(size, 60).convert('RGB').filter(ImageFilter.GaussianBlur(2)),
+        Image.linear_gradient('L').resize(size).convert('RGB'),
+        0.5,
+    )
+
+def make_still(size, format='PNG'):
+    """Build a photo-like still image."""
+    buffer = io.BytesIO()
+    photo_background(size).save(buffer, format=format)
+    return buffer.getvalue()
+
+def make_animation(frames, size):
+    """Build a photo-like animated GIF with a moving object."""
+    width, height = size
+    background = photo_background(size)
+    images = []
+    for index in range(frames):
+        frame = background.copy()
+        x = index * 7 % (width - 80)
+        y = index * 3 % (height - 80)
+        ImageDraw.Draw(frame).ellipse([x, y, x + 80, y + 80], fill=(255, 200, 0))
+        images.append(frame)
+
+    buffer = io.BytesIO()
+    images[0].save(buffer, format='GIF', save_all=True, append_images=images[1:], duration=40, loop=0)
+    return buffer.getvalue()
+
+def image_set(quick=False):
+    """Return {name: (media type, bytes)} for every benchmark image."""
+    images = {}
+    for width, height in QUICK_STILL_SIZES if quick else STILL_SIZES:
+        images[f'still_{width}x{height}.png'] = ('image/png', make_still((width, height)))
+    for (width, height), frames in QUICK_ANIMATIONS if quick else ANIMATIONS:
+        images[f'animated_{width}x{height}x{frames}.gif'] = ('image/gif', make_animation(frames, (width, height)))
+    return images
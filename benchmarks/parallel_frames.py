@@ -0,0 +1,52 @@
+"""Benchmark animated GIF rendering against the number of frame pool workers.
+
+Usage: python benchmarks/parallel_frames.py [--frames 200] [--size 854x480] [--workers 0,1,2,4]
+"""
+import io
+import time
+import argparse
+
+from PIL import Image
+
+from fixtures import make_animation
+from marathi_meme_generator import parallel
+from marathi_meme_generator.render import render_meme
+
+
+def time_render(data, text, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        render_meme(Image.open(io.BytesIO(data)), text)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--frames', type=int, default=200)
+    parser.add_argument('--size', default='854x480')
+    parser.add_argument('--workers', default='0,1,2,4')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    size = tuple(int(value) for value in args.size.split('x'))
+    data = make_animation(args.frames, size)
+    text = 'When the build passes on the first try'
+    parallel.PARALLEL_MIN_PIXELS = 0
+
+    print(f"{args.frames} frames at {size[0]}x{size[1]}")
+    print(f"{'workers':>8} {'seconds':>9} {'speedup':>8}")
+    serial = None
+    for workers in (int(value) for value in args.workers.split(',')):
+        parallel.PARALLEL_WORKERS = workers
+        if workers:
+            # Start the pool and warm fonts and sprites outside the timing
+            render_meme(Image.open(io.BytesIO(data)), text)
+        elapsed = time_render(data, text, args.repeat)
+        serial = serial or elapsed
+        print(f"{workers:>8} {elapsed:>9.2f} {serial / elapsed:>7.2f}x")
+
+
+if __name__ == '__main__':
+    main()
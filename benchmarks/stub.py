@@ -0,0 +1,94 @@
+"""Local HTTP server standing in for the GIPHY search API and memegen.link.
+
+GET /v1/gifs/search answers like GIPHY, with results pointing back at
+this server, and answers 429 like GIPHY does once a quota of searches
+per period is used up. GET /media/<name> serves the benchmark images,
+and GET /images/<template>/<top>/<bottom>.png serves a still image the
+way memegen.link does.
+"""
+import json
+import time
+import zlib
+import threading
+from urllib.parse import parse_qs, urlparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# GIPHY search results per query
+SEARCH_RESULTS = 5
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        images = self.server.images
+        if url.path == '/v1/gifs/search':
+            self.server.searches += 1
+            if not self.server.take_quota():
+                self._send(429, 'application/json', b'{"message": "API rate limit exceeded"}')
+                return
+            query = parse_qs(url.query).get('q', [''])[0]
+            limit = int(parse_qs(url.query).get('limit', [SEARCH_RESULTS])[0])
+            # Each query gets its own stable slice of the animations
+            names = self.server.animations
+            start = zlib.crc32(query.encode('utf-8')) % len(names)
+            picked = [names[(start + offset) % len(names)] for offset in range(min(limit, SEARCH_RESULTS))]
+            data = [{'images': {'original': {'url': self.server.url(f'/media/{name}')}}} for name in picked]
+            self._send(200, 'application/json', json.dumps({'data': data}).encode('utf-8'))
+        elif url.path.startswith('/media/') and url.path[7:] in images:
+            self._send(200, *images[url.path[7:]])
+        elif url.path.startswith('/images/'):
+            self._send(200, *images[self.server.stills[0]])
+        else:
+            self._send(404, 'text/plain', b'not found')
+
+    def _send(self, status, content_type, body):
+        self.server.requests += 1
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'max-age=3600')
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class StubServer(ThreadingHTTPServer):
+    """Serves images ({name: (media type, bytes)}) on a free local port.
+
+    With a quota, only that many searches per period (seconds) succeed.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, images, quota=None, period=3600):
+        super().__init__(('127.0.0.1', 0), _Handler)
+        self.images = images
+        self.animations = sorted(name for name in images if name.endswith('.gif'))
+        self.stills = sorted(name for name in images if not name.endswith('.gif'))
+        self.requests = 0
+        self.searches = 0
+        self.quota = quota
+        self.period = period
+        self._quota_lock = threading.Lock()
+        self._window = (time.monotonic(), 0)
+
+    def take_quota(self):
+        if self.quota is None:
+            return True
+        with self._quota_lock:
+            start, used = self._window
+            if time.monotonic() - start >= self.period:
+                start, used = time.monotonic(), 0
+            self._window = (start, used + 1)
+            return used < self.quota
+
+    def url(self, path):
+        return f'http://127.0.0.1:{self.server_port}{path}'
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name='benchmark-stub', daemon=True).start()
+        return self
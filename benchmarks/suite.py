@@ -0,0 +1,308 @@
+"""Benchmark emotion detection, caption layout, rendering and end-to-end latency.
+
+Usage: python benchmarks/suite.py [--quick] [--stages detect,render] [--output results.json]
+                                  [--baseline baseline.json] [--tolerance 0.25]
+
+Every stage runs in a fresh interpreter with empty blob and result caches,
+so stages neither warm nor slow down one another, and peak RSS belongs to
+the stage alone. End-to-end stages fetch their images from a local stub of
+GIPHY and memegen.link, never from the network. Results are printed and can
+be written as JSON. Given a baseline written by an earlier run, the suite
+exits with status 1 when any stage got slower or bigger than tolerance
+allows.
+"""
+import io
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import shutil
+import resource
+import tempfile
+import subprocess
+from pathlib import Path
+
+import PIL
+from PIL import Image, ImageDraw
+
+import fixtures
+from corpora import CORPORA
+from stub import StubServer
+
+ROOT = Path(__file__).resolve().parents[1]
+
+# Metrics compared against a baseline, and whether a larger value is worse
+COMPARED_METRICS = {
+    'p50_ms': True,
+    'p99_ms': True,
+    'throughput': False,
+    'peak_rss_mb': True,
+}
+
+
+def _captions(count, seed=0):
+    """Captions from every corpus, interleaved."""
+    corpora = [corpus(count, seed) for corpus in CORPORA.values()]
+    return [caption for group in zip(*corpora) for caption in group][:count]
+
+def _detect_stage(corpus, count, analyze):
+    def setup():
+        from marathi_meme_generator import sentiment
+        classify = sentiment.analyze_sentiment if analyze else sentiment.detect_emotion
+        return [lambda caption=caption: classify(caption) for caption in CORPORA[corpus](count)], None
+    return setup
+
+def _layout_stage(corpus, count, size=(800, 600)):
+    def setup():
+        from marathi_meme_generator.layout import calculate_optimal_font_size
+        draw = ImageDraw.Draw(Image.new('RGB', (1, 1)))
+        width, height = size
+        return [
+            lambda caption=caption: calculate_optimal_font_size(draw, caption, width, height, int(height * 0.20))
+            for caption in CORPORA[corpus](count)
+        ], None
+    return setup
+
+def _render_stage(make_image, count):
+    def setup():
+        from marathi_meme_generator.render import render_meme
+        data = make_image()
+        return [
+            lambda caption=caption: render_meme(Image.open(io.BytesIO(data)), caption)
+            for caption in _captions(count)
+        ], None
+    return setup
+
+def _add_text_to_image_stage(count, quick):
+    """The Streamlit path: download through the blob cache, then render."""
+    def setup():
+        from marathi_meme_generator import streamlit_app
+        server = StubServer(fixtures.image_set(quick)).start()
+        urls = [server.url(f'/media/{name}') for name in sorted(server.images)]
+        captions = _captions(count)
+        ops = [
+            lambda url=urls[index % len(urls)], caption=caption: streamlit_app.add_text_to_image(url, caption)
+            for index, caption in enumerate(captions)
+        ]
+        return ops, server.shutdown
+    return setup
+
+def _api_search_stage(count, quick):
+    """POST /search: GIPHY search, download and render in the worker pool."""
+    def setup():
+        server = StubServer(fixtures.image_set(quick)).start()
+        os.environ.update(
+            GIPHY_API_KEY='benchmark',
+            GIPHY_SEARCH_URL=server.url('/v1/gifs/search'),
+            MEME_SOURCE_HOSTS='127.0.0.1',
+        )
+        from fastapi.testclient import TestClient
+        from marathi_meme_generator.main import app
+
+        client = TestClient(app)
+        client.__enter__()
+
+        def search(caption):
+            response = client.post('/search', json={'text': caption})
+            response.raise_for_status()
+
+        def close():
+            client.__exit__(None, None, None)
+            server.shutdown()
+
+        return [lambda caption=caption: search(caption) for caption in _captions(count)], close
+    return setup
+
+def _api_search_throttled_stage(count, quick):
+    """POST /search once the GIPHY quota is used up, with fallbacks from the template library."""
+    def setup():
+        server = StubServer(fixtures.image_set(quick), quota=2).start()
+        templates = tempfile.mkdtemp()
+        os.makedirs(os.path.join(templates, 'neutral'))
+        with open(os.path.join(templates, 'neutral', 'animation.gif'), 'wb') as f:
+            f.write(fixtures.make_animation(10, (320, 240)))
+        os.environ.update(
+            GIPHY_API_KEY='benchmark',
+            GIPHY_SEARCH_URL=server.url('/v1/gifs/search'),
+            MEME_SOURCE_HOSTS='127.0.0.1',
+            MEME_TEMPLATE_DIR=templates,
+        )
+        from marathi_meme_generator import template_library
+        template_library.build_manifest(Path(templates))
+        from fastapi.testclient import TestClient
+        from marathi_meme_generator.main import app
+
+        client = TestClient(app)
+        client.__enter__()
+
+        def search(caption):
+            response = client.post('/search', json={'text': caption})
+            response.raise_for_status()
+
+        def close():
+            client.__exit__(None, None, None)
+            server.shutdown()
+            shutil.rmtree(templates)
+
+        return [lambda caption=caption: search(caption) for caption in _captions(count)], close
+    return setup
+
+def stages(quick=False):
+    """Return {stage name: setup}; setup returns (operations, close or None)."""
+    scale = 0.15 if quick else 1
+    detect = int(2000 * scale)
+    layout = int(300 * scale)
+    registry = {}
+    for corpus in CORPORA:
+        registry[f'detect_emotion.{corpus}'] = _detect_stage(corpus, detect, analyze=False)
+        registry[f'analyze_sentiment.{corpus}'] = _detect_stage(corpus, detect, analyze=True)
+    for corpus in CORPORA:
+        registry[f'layout.{corpus}'] = _layout_stage(corpus, layout)
+    for width, height in fixtures.QUICK_STILL_SIZES if quick else fixtures.STILL_SIZES:
+        registry[f'render.still_{width}x{height}'] = _render_stage(
+            lambda size=(width, height): fixtures.make_still(size), 5 if quick else 20
+        )
+    for (width, height), frames in fixtures.QUICK_ANIMATIONS if quick else fixtures.ANIMATIONS:
+        registry[f'render.animated_{width}x{height}x{frames}'] = _render_stage(
+            lambda size=(width, height), frames=frames: fixtures.make_animation(frames, size), 3 if quick else 6
+        )
+    registry['end_to_end.add_text_to_image'] = _add_text_to_image_stage(6 if quick else 20, quick)
+    registry['end_to_end.api_search'] = _api_search_stage(6 if quick else 20, quick)
+    registry['end_to_end.api_search_throttled'] = _api_search_throttled_stage(10 if quick else 30, quick)
+    return registry
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def _peak_rss_mb():
+    # Render workers count too, once they have exited
+    peak = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+    # Kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+def run_stage(name, quick):
+    """Run one stage in this process and return its measurements."""
+    random.seed(0)
+    operations, close = stages(quick)[name]()
+    # The first operation pays for lazy loading, report it on its own
+    start = time.perf_counter()
+    operations[0]()
+    first = time.perf_counter() - start
+
+    latencies = []
+    for operation in operations[1:]:
+        start = time.perf_counter()
+        operation()
+        latencies.append(time.perf_counter() - start)
+    if close is not None:
+        close()
+
+    total = sum(latencies)
+    return {
+        'operations': len(latencies),
+        'first_ms': 1000 * first,
+        'throughput': len(latencies) / total if total else 0.0,
+        'mean_ms': 1000 * total / len(latencies),
+        'p50_ms': 1000 * _percentile(latencies, 0.50),
+        'p99_ms': 1000 * _percentile(latencies, 0.99),
+        'peak_rss_mb': _peak_rss_mb(),
+    }
+
+def spawn_stage(name, quick):
+    """Run one stage in a fresh interpreter with empty caches."""
+    with tempfile.TemporaryDirectory() as scratch:
+        env = dict(
+            os.environ,
+            MEME_BLOB_CACHE_DIR=os.path.join(scratch, 'blobs'),
+            MEME_RESULT_CACHE_DIR=os.path.join(scratch, 'results'),
+        )
+        command = [sys.executable, __file__, '--run-stage', name] + (['--quick'] if quick else [])
+        result = subprocess.run(command, cwd=ROOT, env=env, capture_output=True, text=True)
+    if result.returncode:
+        raise RuntimeError(f"Stage {name} failed:\n{result.stderr}")
+    return json.loads(result.stdout.splitlines()[-1])
+
+
+def compare(results, baseline, tolerance):
+    """Return a line for every metric that regressed by more than tolerance."""
+    regressions = []
+    for name, stage in results['stages'].items():
+        previous = baseline.get('stages', {}).get(name)
+        if previous is None:
+            continue
+        for metric, larger_is_worse in COMPARED_METRICS.items():
+            old, new = previous.get(metric), stage.get(metric)
+            if not old or not new:
+                continue
+            change = new / old - 1 if larger_is_worse else old / new - 1
+            if change > tolerance:
+                regressions.append(f"{name} {metric}: {old:.2f} -> {new:.2f} ({change:+.0%} worse)")
+    return regressions
+
+def metadata(quick):
+    return {
+        'python': platform.python_version(),
+        'pillow': PIL.__version__,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'quick': quick,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--quick', action='store_true', help="fewer, smaller inputs")
+    parser.add_argument('--stages', help="comma separated stage name prefixes to run")
+    parser.add_argument('--output', help="write results as JSON to this file")
+    parser.add_argument('--baseline', help="JSON results to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="allowed slowdown, 0.25 is 25%%")
+    parser.add_argument('--run-stage', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_stage:
+        print(json.dumps(run_stage(args.run_stage, args.quick)))
+        return 0
+
+    names = list(stages(args.quick))
+    if args.stages:
+        prefixes = tuple(prefix.strip() for prefix in args.stages.split(','))
+        names = [name for name in names if name.startswith(prefixes)]
+
+    results = {'meta': metadata(args.quick), 'stages': {}}
+    print(f"{'stage':<42} {'ops':>5} {'ops/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'first ms':>9} {'RSS MB':>7}")
+    for name in names:
+        stage = spawn_stage(name, args.quick)
+        results['stages'][name] = stage
+        print(
+            f"{name:<42} {stage['operations']:>5} {stage['throughput']:>9.1f} {stage['p50_ms']:>9.2f} "
+            f"{stage['p99_ms']:>9.2f} {stage['first_ms']:>9.2f} {stage['peak_rss_mb']:>7.1f}"
+        )
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline.get('meta', {}).get('quick') != args.quick:
+            print("Warning: the baseline was run with a different --quick setting")
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}")
+        if regressions:
+            return 1
+        print(f"No regressions beyond {args.tolerance:.0%} against {args.baseline}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
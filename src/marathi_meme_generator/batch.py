@@ -0,0 +1,238 @@
+"""Render memes for a JSONL file of captions.
+
+Usage: python -m marathi_meme_generator.batch captions.jsonl -o out/ [--workers 4]
+
+Every caption is classified once, each search term and source image is
+fetched once for the whole file, and memes render in a pool of worker
+processes. Images are written to the output directory next to a
+manifest.jsonl with one line per finished caption; running the same
+command again skips the captions already rendered.
+"""
+import os
+import re
+import sys
+import json
+import random
+import hashlib
+import logging
+import argparse
+import multiprocessing
+from pathlib import Path
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+from marathi_meme_generator.blob_cache import get_blob_cache
+from marathi_meme_generator.giphy import (
+    DEFAULT_SEARCH_TERMS,
+    DOWNLOAD_TIMEOUT,
+    fallback_meme,
+    get_http_session,
+    load_meme_config,
+    search_giphy,
+)
+from marathi_meme_generator.layout import get_script
+from marathi_meme_generator.ratelimit import GiphyUnavailable
+from marathi_meme_generator.render import init_worker, render_source, size_target
+from marathi_meme_generator.search_cache import SearchCache
+from marathi_meme_generator.sentiment import analyze_sentiment_batch, read_captions
+from marathi_meme_generator.template_library import OFFLINE_MODE, is_template_url
+
+BATCH_DOWNLOADS = int(os.getenv("MEME_BATCH_DOWNLOADS", "8"))
+
+MANIFEST = 'manifest.jsonl'
+EXTENSIONS = {'image/gif': 'gif', 'image/webp': 'webp', 'image/png': 'png'}
+
+
+def item_id(record, text, id_field):
+    """Return the id of a caption: its id field, or a digest of the caption."""
+    if record.get(id_field) is not None:
+        return str(record[id_field])
+    key = f"{text}\0{record.get('language', '')}"
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()[:16]
+
+def read_manifest(path):
+    """Return the ids recorded as rendered in a manifest, if there is one."""
+    done = set()
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A line cut short by an interrupted run
+                    continue
+                if entry.get('status') == 'ok':
+                    done.add(entry['id'])
+    except FileNotFoundError:
+        pass
+    return done
+
+
+class MemePicker:
+    """Picks the source image of every caption from its emotion.
+
+    Searches go through one SearchCache, so each term is fetched at most
+    once per run. Picks are seeded by the caption id, so a resumed run picks
+    the same image for a caption as long as the search results match.
+    Without Giphy, templates of the template library are picked first.
+    """
+
+    def __init__(self, config):
+        self.search_terms = config.get('search_terms', {})
+        self.fallback_memes = config.get('fallback_memes', {})
+        self.search_cache = SearchCache(search_giphy)
+        self.use_giphy = bool(os.getenv("GIPHY_API_KEY")) and not OFFLINE_MODE
+        self.unavailable = set()
+
+    def pick(self, key, emotion):
+        rng = random.Random(key)
+        if self.use_giphy:
+            terms = self.search_terms.get(emotion, DEFAULT_SEARCH_TERMS)
+            term = rng.choice(terms)
+            try:
+                urls = self.search_cache.get(term)
+                if urls:
+                    return rng.choice(urls)
+            except GiphyUnavailable as e:
+                # Refused searches cost nothing, only say why once
+                if e.reason not in self.unavailable:
+                    logging.warning(f"Using fallback memes: {str(e)}")
+                self.unavailable.add(e.reason)
+            except Exception as e:
+                logging.warning(f"Failed to search with term '{term}': {str(e)}")
+        return fallback_meme(emotion, self.fallback_memes, rng)
+
+
+def fetch_source(url):
+    """Download url into the blob cache and return its record."""
+    blob_cache = get_blob_cache()
+    blob_cache.fetch(url, get_http_session(), timeout=DOWNLOAD_TIMEOUT).close()
+    return blob_cache.lookup(url)
+
+def _file_stem(key):
+    # Ids come from the input file, keep them from naming other directories
+    return re.sub(r'[^\w.-]', '_', key).lstrip('.') or '_'
+
+def _ends_with_newline(path):
+    with open(path, 'rb') as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b'\n'
+
+def _write_output(path, content):
+    temp = path.with_name(path.name + '.tmp')
+    temp.write_bytes(content)
+    os.replace(temp, path)
+
+def run_batch(items, output_dir, workers, animated_format='gif', target=None):
+    """Render (id, text, language, record) items into output_dir.
+
+    Yields one manifest entry per item as it finishes, after its image
+    has been written. Items that fail are recorded with their error.
+    """
+    picker = MemePicker(load_meme_config())
+    emotions = analyze_sentiment_batch([text for _, text, _, _ in items])
+
+    downloads = {}
+    in_flight = {}
+    with ThreadPoolExecutor(BATCH_DOWNLOADS) as fetcher, ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+        initializer=init_worker
+    ) as pool:
+        # Every source image is downloaded once, ahead of the renders that need it
+        picks = []
+        for (key, text, language, record), emotion in zip(items, emotions):
+            url = record.get('source_url') or picker.pick(key, emotion)
+            if not OFFLINE_MODE and url not in downloads and not is_template_url(url):
+                downloads[url] = fetcher.submit(fetch_source, url)
+            picks.append((key, text, language, emotion, url))
+
+        def finish(done):
+            for future in done:
+                entry = in_flight.pop(future)
+                try:
+                    content, media_type = future.result()
+                    path = output_dir / f"{_file_stem(entry['id'])}.{EXTENSIONS[media_type]}"
+                    _write_output(path, content)
+                    entry.update(status='ok', file=path.name, media_type=media_type)
+                except Exception as e:
+                    entry.update(status='error', error=str(e))
+                yield entry
+
+        for key, text, language, emotion, url in picks:
+            entry = {'id': key, 'text': text, 'emotion': emotion, 'source_url': url}
+            if OFFLINE_MODE and not is_template_url(url):
+                entry.update(status='error', error="Only templates are available offline")
+                yield entry
+                continue
+            try:
+                # Templates render from the frames every worker decoded at start
+                source = url if is_template_url(url) else downloads[url].result()
+            except Exception as e:
+                entry.update(status='error', error=f"Download failed: {str(e)}")
+                yield entry
+                continue
+            future = pool.submit(
+                render_source, source, text, get_script(language), animated_format, target
+            )
+            in_flight[future] = entry
+            # Keep a few renders queued per worker without holding every result
+            if len(in_flight) >= workers * 4:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                yield from finish(done)
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            yield from finish(done)
+
+def main(argv=None):
+    """Render a meme for every caption of a JSONL file."""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('input', help="JSONL file of captions, '-' for stdin")
+    parser.add_argument('-o', '--output', required=True, help="directory for images and manifest.jsonl")
+    parser.add_argument('--field', default='text', help="caption field of each record")
+    parser.add_argument('--id-field', default='id', help="id field of each record")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 2)
+    parser.add_argument('--format', choices=('gif', 'webp'), default='gif', help="format of animations")
+    parser.add_argument('--size', help="size tier: thumb, small, medium, large or original")
+    parser.add_argument('--max-dimension', type=int, help="longest side of the memes, in pixels")
+    args = parser.parse_args(argv)
+    try:
+        target = size_target(args.size, args.max_dimension)
+    except ValueError as e:
+        parser.error(str(e))
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    output_dir = Path(args.output)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    manifest_path = output_dir / MANIFEST
+    done = read_manifest(manifest_path)
+
+    source = sys.stdin if args.input == '-' else open(args.input, 'r', encoding='utf-8')
+    try:
+        items = []
+        seen = set(done)
+        for record in read_captions(source, args.field):
+            text = str(record.get(args.field, ''))
+            key = item_id(record, text, args.id_field)
+            if not text or key in seen:
+                continue
+            seen.add(key)
+            items.append((key, text, record.get('language'), record))
+    finally:
+        if source is not sys.stdin:
+            source.close()
+
+    logging.info(f"{len(items)} captions to render, {len(done)} already done")
+    counts = {'ok': 0, 'error': 0}
+    if items:
+        with open(manifest_path, 'a+', encoding='utf-8') as manifest:
+            # Start on a fresh line if an interrupted run cut the last one short
+            if manifest.tell() and not _ends_with_newline(manifest_path):
+                manifest.write('\n')
+            for entry in run_batch(items, output_dir, args.workers, args.format, target):
+                manifest.write(json.dumps(entry, ensure_ascii=False) + '\n')
+                manifest.flush()
+                counts[entry['status']] += 1
+    logging.info(f"Rendered {counts['ok']} memes, {counts['error']} failed")
+    return 1 if counts['error'] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
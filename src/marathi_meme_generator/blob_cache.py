@@ -0,0 +1,246 @@
+import os
+import io
+import re
+import json
+import mmap
+import time
+import hashlib
+import tempfile
+import functools
+import threading
+from pathlib import Path
+from email.utils import parsedate_to_datetime
+
+import requests
+
+from marathi_meme_generator import metrics
+
+# Where downloaded source images are kept, and how much of them
+BLOB_CACHE_DIR = os.getenv(
+    "MEME_BLOB_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "marathi-meme-generator", "blobs"),
+)
+BLOB_CACHE_MAX_BYTES = int(os.getenv("MEME_BLOB_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+# Seconds a download is trusted without revalidation when the server says nothing
+BLOB_CACHE_TTL = float(os.getenv("MEME_BLOB_CACHE_TTL", "86400"))
+# Seconds between scans of the whole cache, which pick up blobs stored by other processes
+BLOB_CACHE_SCAN_INTERVAL = float(os.getenv("MEME_BLOB_CACHE_SCAN_INTERVAL", "60"))
+
+MAX_AGE_PATTERN = re.compile(r'max-age=(\d+)')
+
+
+def _atomic_write(path, data):
+    """Write data to path so concurrent readers see either nothing or all of it."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+def _freshness(headers):
+    """Return how many seconds a response may be reused without revalidation."""
+    cache_control = headers.get('Cache-Control', '')
+    if 'no-cache' in cache_control or 'no-store' in cache_control:
+        return 0
+    match = MAX_AGE_PATTERN.search(cache_control)
+    if match:
+        return int(match.group(1))
+    if headers.get('Expires') and headers.get('Date'):
+        try:
+            expires = parsedate_to_datetime(headers['Expires'])
+            date = parsedate_to_datetime(headers['Date'])
+            return max(0, (expires - date).total_seconds())
+        except (TypeError, ValueError):
+            pass
+    return BLOB_CACHE_TTL
+
+
+class BlobCache:
+    """Content-addressed on-disk cache of downloaded files, shared by all workers.
+
+    Blobs are stored once per content hash under objects/, and each URL has a
+    small JSON record under urls/ pointing at its blob together with the
+    validators (ETag / Last-Modified) needed to revalidate it. Least recently
+    used blobs are evicted once the cache grows past max_bytes, together
+    with the records pointing at them.
+
+    Each process keeps a running total of the cache size, from its last
+    scan plus what it stored since, and only scans the cache when that total
+    is over budget or every scan_interval seconds.
+    """
+
+    def __init__(self, root=BLOB_CACHE_DIR, max_bytes=BLOB_CACHE_MAX_BYTES,
+                 scan_interval=BLOB_CACHE_SCAN_INTERVAL):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.scan_interval = scan_interval
+        self._lock = threading.Lock()
+        self._total = None  # bytes, unknown until the first scan
+        self._scanned_at = 0.0
+        self._stats = {'hits': 0, 'revalidated': 0, 'misses': 0, 'evictions': 0}
+
+    def _record_path(self, url):
+        return self.root / 'urls' / (hashlib.sha256(url.encode('utf-8')).hexdigest() + '.json')
+
+    def _object_path(self, digest):
+        return self.root / 'objects' / digest[:2] / digest
+
+    def lookup(self, url):
+        """Return the cache record of url, or None when it is not cached."""
+        try:
+            record = json.loads(self._record_path(url).read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            return None
+        if record.get('url') != url or not self._object_path(record['digest']).exists():
+            # Blob was evicted by some worker
+            return None
+        return record
+
+    def is_fresh(self, record):
+        return time.time() - record['fetched_at'] < record['max_age']
+
+    def conditional_headers(self, record):
+        """Return the request headers revalidating record."""
+        headers = {}
+        if record and record.get('etag'):
+            headers['If-None-Match'] = record['etag']
+        if record and record.get('last_modified'):
+            headers['If-Modified-Since'] = record['last_modified']
+        return headers
+
+    def open(self, record):
+        """Return a read-only memory map (or an empty buffer) of record's blob."""
+        path = self._object_path(record['digest'])
+        with open(path, 'rb') as f:
+            # Bump the mtime so eviction sees this blob as recently used
+            os.utime(f.fileno())
+            if os.fstat(f.fileno()).st_size == 0:
+                return io.BytesIO(b'')
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def store(self, url, content, headers):
+        """Save a downloaded response and return its record."""
+        digest = hashlib.sha256(content).hexdigest()
+        object_path = self._object_path(digest)
+        stored = not object_path.exists()
+        if stored:
+            _atomic_write(object_path, content)
+        record = {
+            'url': url,
+            'digest': digest,
+            'size': len(content),
+            'etag': headers.get('ETag'),
+            'last_modified': headers.get('Last-Modified'),
+            'content_type': headers.get('Content-Type'),
+            'fetched_at': time.time(),
+            'max_age': _freshness(headers),
+        }
+        _atomic_write(self._record_path(url), json.dumps(record).encode('utf-8'))
+        with self._lock:
+            if stored and self._total is not None:
+                self._total += len(content)
+            due = (
+                self._total is None or self._total > self.max_bytes
+                or time.monotonic() - self._scanned_at >= self.scan_interval
+            )
+        if due:
+            self.evict()
+        return record
+
+    def revalidated(self, url, record, headers):
+        """Mark record as fresh again after a 304 Not Modified response."""
+        record = dict(record)
+        record['fetched_at'] = time.time()
+        record['max_age'] = _freshness(headers)
+        record['etag'] = headers.get('ETag') or record.get('etag')
+        _atomic_write(self._record_path(url), json.dumps(record).encode('utf-8'))
+        return record
+
+    def evict(self):
+        """Delete least recently used blobs until the cache fits in max_bytes,
+        and the URL records of the blobs deleted."""
+        blobs = []
+        total = 0
+        for path in (self.root / 'objects').glob('*/*'):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            blobs.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+        evicted = set()
+        if total > self.max_bytes:
+            blobs.sort()
+            for _, size, path in blobs:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    path.unlink()
+                    total -= size
+                    evicted.add(path.name)
+                    self.count('evictions')
+                except FileNotFoundError:
+                    pass
+        with self._lock:
+            self._total = total
+            self._scanned_at = time.monotonic()
+        if evicted:
+            self._remove_records(evicted)
+
+    def _remove_records(self, digests):
+        for path in (self.root / 'urls').glob('*.json'):
+            try:
+                if json.loads(path.read_text(encoding='utf-8')).get('digest') in digests:
+                    path.unlink()
+            except (OSError, ValueError):
+                pass
+
+    def fetch(self, url, session=None, timeout=10):
+        """Return url's content as a buffer, downloading only when needed."""
+        record = self.lookup(url)
+        if record and self.is_fresh(record):
+            try:
+                buffer = self.open(record)
+                self.count('hits')
+                return buffer
+            except FileNotFoundError:
+                # Evicted by another worker since the lookup
+                record = None
+
+        with metrics.span('download'):
+            response = (session or requests).get(
+                url, headers=self.conditional_headers(record), timeout=timeout
+            )
+        if response.status_code == 304 and record:
+            self.count('revalidated')
+            return self.open(self.revalidated(url, record, response.headers))
+
+        response.raise_for_status()
+        self.count('misses')
+        metrics.increment('meme_bytes_total', len(response.content), direction='in')
+        return self.open(self.store(url, response.content, response.headers))
+
+    def stats(self):
+        """Return hit/revalidation/miss counters of this process."""
+        with self._lock:
+            return dict(self._stats)
+
+    def count(self, name):
+        """Count a hit, revalidation, miss or eviction; for callers that download themselves."""
+        with self._lock:
+            self._stats[name] += 1
+        metrics.increment('meme_cache_total', cache='blob', result=name)
+
+
+@functools.lru_cache(maxsize=None)
+def get_blob_cache():
+    """Get the process-wide blob cache."""
+    return BlobCache()
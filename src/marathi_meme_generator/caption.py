@@ -0,0 +1,72 @@
+import os
+import math
+import functools
+from typing import NamedTuple
+
+from PIL import Image, ImageDraw
+
+from marathi_meme_generator.layout import get_caption_layout, text_script
+from marathi_meme_generator.metrics import span
+
+OUTLINE_WIDTH = 2
+
+# Number of rendered caption sprites kept in memory
+SPRITE_CACHE_SIZE = int(os.getenv("MEME_SPRITE_CACHE_SIZE", "64"))
+
+
+class CaptionSprite(NamedTuple):
+    """Pre-rendered caption banner covering the bottom of an image from row top."""
+    image: Image.Image
+    top: int
+    opaque: bool
+
+
+@functools.lru_cache(maxsize=SPRITE_CACHE_SIZE)
+def _render_caption_sprite(text, width, height, script):
+    with span('layout'):
+        layout = get_caption_layout(text, width, height, script)
+    band_top = height - layout.border_height
+
+    # Short images can push the outlined text above the banner, so start the
+    # sprite wherever the text starts
+    top = max(0, min(band_top, math.floor(layout.y) - OUTLINE_WIDTH))
+
+    with span('draw'):
+        sprite = Image.new('RGBA', (width, height - top), (0, 0, 0, 0))
+        draw = ImageDraw.Draw(sprite)
+        draw.rectangle(
+            [(0, band_top - top), (width, height - top)],
+            fill=(0, 0, 0, 255)
+        )
+
+        # One pass with a native stroke replaces drawing the text at every
+        # outline offset
+        draw.multiline_text(
+            (layout.x, layout.y - top),
+            layout.wrapped_text,
+            font=layout.font,
+            fill=(255, 255, 255, 255),
+            align='center',
+            spacing=layout.line_spacing,
+            stroke_width=OUTLINE_WIDTH,
+            stroke_fill=(0, 0, 0, 255)
+        )
+
+    return CaptionSprite(sprite, top, top == band_top)
+
+def get_caption_sprite(text, width, height, script=None):
+    """Get the rendered caption for text on an image of the given size (memoized)."""
+    return _render_caption_sprite(text, width, height, script or text_script(text))
+
+def apply_caption(image, sprite):
+    """Composite sprite onto the bottom of an RGBA image in place."""
+    if sprite.opaque:
+        # Banner covers every pixel of the sprite, a plain blit is enough
+        image.paste(sprite.image, (0, sprite.top))
+    else:
+        image.alpha_composite(sprite.image, (0, sprite.top))
+    return image
+
+def sprite_cache_info():
+    """Return hit/miss statistics of the sprite cache."""
+    return _render_caption_sprite.cache_info()
@@ -0,0 +1,213 @@
+import os
+import time
+import asyncio
+import hashlib
+import logging
+import threading
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from marathi_meme_generator import metrics
+from marathi_meme_generator.blob_cache import _atomic_write
+
+# Directory of lock files through which processes coalesce identical work;
+# empty coalesces within each process only
+COALESCE_LOCK_DIR = os.getenv("MEME_COALESCE_LOCK_DIR", "")
+# Seconds a process waits for another one's lock before doing the work itself
+COALESCE_WAIT = float(os.getenv("MEME_COALESCE_WAIT", "30"))
+
+LOCK_POLL_INTERVAL = 0.02
+# Lock and result files untouched this long are deleted
+STALE_FILE_AGE = 300
+
+
+def flight_key(*parts):
+    """Return the key of a piece of work from the parts that identify it."""
+    return hashlib.sha256('\0'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Runs work once per key while it is in flight; callers with the same
+    key wait for it and share its result.
+
+    run() is for coroutines on one event loop, call() for threads. Errors
+    reach every waiter and are not remembered, so the next caller tries
+    again. With lock_dir, processes sharing the directory coalesce too: the
+    first takes a lock file for the key, the others wait for it and read
+    the result it left there, turned into bytes by encode / decode.
+    """
+
+    def __init__(self, name, lock_dir=COALESCE_LOCK_DIR, encode=None, decode=None):
+        self.name = name
+        self.lock_dir = Path(lock_dir) if lock_dir and encode and fcntl else None
+        self.encode = encode
+        self.decode = decode
+        self._lock = threading.Lock()
+        self._tasks = {}
+        self._calls = {}
+        self._last_prune = 0.0
+        self._stats = {'leaders': 0, 'coalesced': 0, 'cross_process': 0}
+        if lock_dir and self.lock_dir is None:
+            logging.warning(f"Coalescing {name} within this process only")
+
+    async def run(self, key, fn, *args):
+        """Await fn(*args), or the run of it already in flight for key."""
+        while True:
+            task = self._tasks.get(key)
+            if task is None:
+                self._count('leaders')
+                task = self._tasks[key] = asyncio.ensure_future(self._lead_async(key, fn, *args))
+                task.add_done_callback(lambda done: self._finish(key, done))
+            else:
+                self._count('coalesced')
+            # A waiter going away must not cancel the work for the others,
+            # so wait for the run to end rather than awaiting it: only our
+            # own cancellation is raised here
+            await asyncio.wait([task])
+            if not task.cancelled():
+                return task.result()
+            # The run itself was cancelled, e.g. with the batch it ran for
+
+    def call(self, key, fn, *args):
+        """Call fn(*args), or wait for the call already in flight for key."""
+        with self._lock:
+            flight = self._calls.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._calls[key] = _Call()
+        if not leader:
+            self._count('coalesced')
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        self._count('leaders')
+        try:
+            flight.result = self._lead_sync(key, fn, *args)
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            flight.done.set()
+
+    def stats(self):
+        """Return how many runs led and how many callers shared one."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['in_flight'] = len(self._tasks) + len(self._calls)
+        return stats
+
+    def _finish(self, key, task):
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        if not task.cancelled():
+            # Retrieved here in case every waiter went away
+            task.exception()
+
+    async def _lead_async(self, key, fn, *args):
+        if self.lock_dir is None:
+            return await fn(*args)
+        started = time.time()
+        lock = self._try_lock(key)
+        while lock is None and time.time() - started < COALESCE_WAIT:
+            await asyncio.sleep(LOCK_POLL_INTERVAL)
+            lock = self._try_lock(key)
+        try:
+            result = self._read_result(key, started)
+            if result is None:
+                result = await fn(*args)
+                self._write_result(key, result)
+            return result
+        finally:
+            self._unlock(lock)
+
+    def _lead_sync(self, key, fn, *args):
+        if self.lock_dir is None:
+            return fn(*args)
+        started = time.time()
+        lock = self._try_lock(key)
+        while lock is None and time.time() - started < COALESCE_WAIT:
+            time.sleep(LOCK_POLL_INTERVAL)
+            lock = self._try_lock(key)
+        try:
+            result = self._read_result(key, started)
+            if result is None:
+                result = fn(*args)
+                self._write_result(key, result)
+            return result
+        finally:
+            self._unlock(lock)
+
+    def _try_lock(self, key):
+        """Return the open lock file of key once it is ours, or None while another process holds it."""
+        self.lock_dir.mkdir(parents=True, exist_ok=True)
+        fd = os.open(self.lock_dir / f"{key}.lock", os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return None
+        # Keeps the file from being pruned while it is in use
+        os.utime(fd)
+        return fd
+
+    def _unlock(self, fd):
+        if fd is not None:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+    def _read_result(self, key, started):
+        """Return what another process made for key since we started waiting, if anything."""
+        path = self.lock_dir / f"{key}.result"
+        try:
+            if path.stat().st_mtime < started:
+                return None
+            result = self.decode(path.read_bytes())
+        except (OSError, ValueError):
+            return None
+        self._count('cross_process')
+        return result
+
+    def _write_result(self, key, result):
+        try:
+            _atomic_write(self.lock_dir / f"{key}.result", self.encode(result))
+        except OSError as e:
+            logging.warning(f"Failed to share {self.name} result: {str(e)}")
+        self._prune()
+
+    def _prune(self):
+        """Delete the lock and result files of keys nobody asked for in a while."""
+        now = time.time()
+        if now - self._last_prune < STALE_FILE_AGE:
+            return
+        self._last_prune = now
+        for path in self.lock_dir.iterdir():
+            try:
+                if now - path.stat().st_mtime > STALE_FILE_AGE:
+                    # A process that opened the lock file just before this
+                    # leads on its own, which only costs a duplicate run
+                    path.unlink()
+            except FileNotFoundError:
+                pass
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+        if name != 'leaders':
+            scope = 'process' if name == 'coalesced' else 'cross_process'
+            metrics.increment('meme_coalesced_total', flight=self.name, scope=scope)
@@ -0,0 +1,264 @@
+import os
+from typing import NamedTuple, Optional, Tuple
+
+from PIL import Image, ImageChops, GifImagePlugin
+
+# Colours reserved for the anti-aliased caption when reusing a source palette
+CAPTION_COLORS = 16
+# Largest per-channel error accepted when mapping a frame onto a shared palette
+PALETTE_TOLERANCE = int(os.getenv("MEME_PALETTE_TOLERANCE", "12"))
+WEBP_QUALITY = int(os.getenv("MEME_WEBP_QUALITY", "80"))
+WEBP_METHOD = int(os.getenv("MEME_WEBP_METHOD", "4"))
+
+# GIF disposal methods
+DISPOSE_NONE = 1
+DISPOSE_BACKGROUND = 2
+
+
+def _colors(palette):
+    """Return the distinct RGB triples of a flat palette list, in order."""
+    triples = []
+    for i in range(0, len(palette) - 2, 3):
+        color = tuple(palette[i:i + 3])
+        if color not in triples:
+            triples.append(color)
+    return triples
+
+def _palette_image(colors):
+    image = Image.new('P', (1, 1))
+    image.putpalette([channel for color in colors for channel in color])
+    return image
+
+def shared_palette(frame, source_palette, caption_top):
+    """Build the palette every frame of an animation is mapped onto.
+
+    The source palette is kept as is; only the caption band is quantized,
+    to a handful of colours that replace the least used source colours when
+    the palette is full. One index is left free for transparency.
+    """
+    colors = _colors(source_palette)
+    band = frame.crop((0, caption_top, frame.width, frame.height)).convert('RGB')
+    caption = [
+        color for color in _colors(band.quantize(CAPTION_COLORS).getpalette())
+        if color not in colors
+    ]
+
+    overflow = len(colors) + len(caption) - 255
+    if overflow > 0:
+        body = frame.crop((0, 0, frame.width, caption_top)).convert('RGB')
+        counts = body.quantize(palette=_palette_image(colors), dither=Image.Dither.NONE).histogram()
+        least_used = set(sorted(range(len(colors)), key=lambda index: counts[index])[:overflow])
+        colors = [color for index, color in enumerate(colors) if index not in least_used]
+    return _palette_image(colors + caption)
+
+def _to_paletted(frame, palette=None, body_height=0):
+    """Quantize an RGBA frame for GIF.
+
+    Returns the paletted frame, its transparent index and whether it needs
+    a colour table of its own. With a shared palette the frame is mapped
+    onto it, as long as the rows above the caption (the first body_height)
+    keep their colours; frames that do not fit it (source frames with their
+    own local palette) are quantized on their own, trimmed to the colours
+    they use.
+    """
+    alpha = frame.getchannel('A')
+    if palette is not None:
+        rgb = frame.convert('RGB')
+        paletted = rgb.quantize(palette=palette, dither=Image.Dither.NONE)
+        body = (0, 0, frame.width, max(0, min(body_height, frame.height)))
+        error = ImageChops.difference(paletted.crop(body).convert('RGB'), rgb.crop(body)).getextrema()
+        if max(high for _, high in error) <= PALETTE_TOLERANCE:
+            # The index after the shared colours is kept for transparency
+            transparency = len(palette.getpalette()) // 3
+            if alpha.getextrema()[0] < 255:
+                paletted.paste(transparency, mask=alpha.point(lambda value: 255 if value < 128 else 0))
+            return paletted, transparency, False
+
+    paletted = frame.convert('P', palette=Image.Palette.ADAPTIVE)
+    transparency = None
+    if paletted.palette.mode == 'RGBA':
+        for rgba, index in paletted.palette.colors.items():
+            if rgba[3] == 0:
+                transparency = index
+                break
+    used = [index for index, count in enumerate(paletted.histogram()) if count]
+    paletted = paletted.remap_palette(used)
+    if transparency is not None:
+        transparency = used.index(transparency) if transparency in used else None
+    return paletted, transparency, True
+
+def _changed_pixels(previous, frame, bbox):
+    """Crop frame to bbox, making pixels unchanged since previous transparent.
+
+    Runs of transparent pixels compress far better than repeated colours.
+    """
+    crop = frame.crop(bbox)
+    r, g, b, _ = ImageChops.difference(previous.crop(bbox), crop).split()
+    changed = ImageChops.lighter(ImageChops.lighter(r, g), b)
+    unchanged = changed.point(lambda value: 255 if value == 0 else 0)
+    crop.paste((0, 0, 0, 0), mask=unchanged)
+    return crop
+
+
+class _PendingFrame:
+    """A frame waiting to be written, until we know how long it is shown."""
+
+    def __init__(self, paletted, transparency, offset, duration, disposal, local_palette):
+        self.paletted = paletted
+        self.transparency = transparency
+        self.offset = offset
+        self.duration = duration
+        self.disposal = disposal
+        self.local_palette = local_palette
+
+    def write(self, fp):
+        params = {
+            'duration': self.duration,
+            'disposal': self.disposal,
+            'include_color_table': self.local_palette,
+        }
+        if self.transparency is not None:
+            params['transparency'] = self.transparency
+        for chunk in GifImagePlugin.getdata(self.paletted, self.offset, **params):
+            fp.write(chunk)
+
+
+def encode_region(previous, frame, palette=None, caption_top=0, transparent=False):
+    """Quantize the part of frame that has to be written after previous.
+
+    Returns a FrameRegion, or None when frame is identical to previous.
+    Opaque animations are written as the regions that changed since the
+    previous frame. Animations with transparency are written as whole
+    frames disposed to the background, so that pixels which become
+    transparent do not keep showing the previous frame.
+    """
+    bbox = ImageChops.difference(previous, frame).getbbox(alpha_only=False)
+    if bbox is None:
+        return None
+    if transparent:
+        bbox = (0, 0) + frame.size
+        region = frame
+    else:
+        region = _changed_pixels(previous, frame, bbox)
+    paletted, transparency, own_palette = _to_paletted(region, palette, caption_top - bbox[1])
+    return FrameRegion(paletted, transparency, bbox[:2], own_palette)
+
+
+class FrameRegion(NamedTuple):
+    """Quantized region of an animation frame, ready to be written."""
+    paletted: Image.Image
+    transparency: Optional[int]
+    offset: Tuple[int, int]
+    own_palette: bool
+
+
+class GifWriter:
+    """Writes an animated GIF to fp one frame at a time.
+
+    Only the previous frame is held in memory, plus the last written one
+    until its duration is known: consecutive identical frames are merged
+    into one longer frame. When palette is given (see shared_palette, with
+    the same caption_top) frames are mapped onto it and share the global
+    colour table.
+    """
+
+    def __init__(self, fp, loop=0, palette=None, caption_top=0, transparent=False):
+        self.fp = fp
+        self.loop = loop
+        self.palette = palette
+        self.caption_top = caption_top
+        self.transparent = transparent
+        self.disposal = DISPOSE_BACKGROUND if transparent else DISPOSE_NONE
+        self.previous = None
+        self._pending = None
+
+    def add(self, frame, duration):
+        """Add the next (RGBA) frame of the animation."""
+        if self.previous is None:
+            self._start(frame, duration)
+        else:
+            region = encode_region(
+                self.previous, frame, self.palette, self.caption_top, self.transparent
+            )
+            self.add_region(region, duration)
+        self.previous = frame
+
+    def add_region(self, region, duration):
+        """Add the next frame as already returned by encode_region."""
+        if region is None:
+            self._pending.duration += duration
+            return
+        self._pending.write(self.fp)
+        self._pending = _PendingFrame(
+            region.paletted, region.transparency, region.offset, duration,
+            self.disposal, region.own_palette
+        )
+
+    def close(self):
+        """Write the last frame and the trailer."""
+        if self._pending is not None:
+            self._pending.write(self.fp)
+        self.fp.write(b';')
+
+    def _start(self, frame, duration):
+        paletted, transparency, own_palette = _to_paletted(frame, self.palette, self.caption_top)
+        if own_palette:
+            self.palette = None
+        else:
+            paletted.putpalette(self.palette.getpalette() + [0, 0, 0])
+        info = {'loop': self.loop, 'duration': duration}
+        if transparency is not None:
+            info['transparency'] = transparency
+        header, _ = GifImagePlugin.getheader(paletted, info=info)
+        self.fp.write(b''.join(header))
+        self._pending = _PendingFrame(paletted, transparency, (0, 0), duration, self.disposal, False)
+
+
+def write_gif(frames, fp, loop=0, palette=None, caption_top=0, transparent=False):
+    """Encode (RGBA frame, duration) pairs to fp as an animated GIF."""
+    writer = GifWriter(fp, loop, palette, caption_top, transparent)
+    for frame, duration in frames:
+        writer.add(frame, duration)
+    writer.close()
+
+
+class _StreamedAnimation(Image.Image):
+    """Seekable animation whose frames are pulled from an iterator on demand.
+
+    Lets Pillow's save_all encoders walk a frame generator one frame at a
+    time instead of a list of decoded frames. durations is filled in as
+    frames are visited, which is when the encoders read it.
+    """
+
+    def __init__(self, frames, size, n_frames):
+        super().__init__()
+        self._frames = iter(frames)
+        self._size = size
+        self._mode = 'RGBA'
+        self.n_frames = n_frames
+        self.is_animated = n_frames > 1
+        self.durations = []
+        self._frame = -1
+        self.seek(0)
+
+    def tell(self):
+        return self._frame
+
+    def seek(self, frame):
+        if frame <= self._frame:
+            # Encoders seek back to the first frame once they are done
+            return
+        while self._frame < frame:
+            image, duration = next(self._frames)
+            self.durations.append(duration)
+            self._frame += 1
+        self.im = image.im
+
+
+def write_webp(frames, fp, size, n_frames, loop=0):
+    """Encode n_frames (RGBA frame, duration) pairs to fp as an animated WebP."""
+    animation = _StreamedAnimation(frames, size, n_frames)
+    animation.save(
+        fp, format='WEBP', save_all=True, duration=animation.durations,
+        loop=loop, quality=WEBP_QUALITY, method=WEBP_METHOD
+    )
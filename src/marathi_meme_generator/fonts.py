@@ -0,0 +1,91 @@
+import os
+import io
+import logging
+import threading
+import functools
+from pathlib import Path
+
+from PIL import ImageFont
+
+# Fonts shipped with the project
+PROJECT_FONTS_DIR = Path(__file__).resolve().parents[2] / 'static' / 'fonts'
+
+# Candidate font files per script, in order of preference. Paths listed in
+# MEME_FONT_LATIN / MEME_FONT_DEVANAGARI (os.pathsep separated) come first.
+FONT_CANDIDATES = {
+    'latin': [
+        PROJECT_FONTS_DIR / 'Impact.ttf',
+        Path('static/fonts/Impact.ttf'),  # Local project directory
+        Path('/Library/Fonts/Impact.ttf'),  # macOS
+        Path('/usr/share/fonts/truetype/noto/Impact.ttf'),  # Linux
+        Path('C:\\Windows\\Fonts\\Impact.ttf'),  # Windows
+        Path('/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf'),  # Linux fallback
+    ],
+    'devanagari': [
+        PROJECT_FONTS_DIR / 'NotoSansMarathi-Regular.ttf',
+        Path('static/fonts/NotoSansMarathi-Regular.ttf'),  # Local project directory
+        Path('static/fonts/NotoSansDevanagari-Regular.ttf'),
+        Path('/System/Library/Fonts/Supplemental/Noto Sans Devanagari.ttf'),  # macOS
+        Path('/usr/share/fonts/truetype/noto/NotoSansDevanagari-Regular.ttf'),  # Linux
+        Path('C:\\Windows\\Fonts\\NotoSansDevanagari-Regular.ttf'),  # Windows
+    ],
+}
+
+# Number of (script, size) FreeType faces kept alive
+FONT_CACHE_SIZE = int(os.getenv("MEME_FONT_CACHE_SIZE", "128"))
+
+_load_lock = threading.Lock()
+_font_data = None  # script -> font file bytes, or None when nothing usable was found
+
+
+def _configured_paths(script):
+    value = os.getenv(f"MEME_FONT_{script.upper()}", "")
+    return [Path(p) for p in value.split(os.pathsep) if p]
+
+def _read_font(path):
+    """Return the bytes of path if it is a loadable font file, else None."""
+    try:
+        data = path.read_bytes()
+        # Reject placeholders and truncated downloads up front
+        ImageFont.truetype(io.BytesIO(data), 10)
+        return data
+    except Exception:
+        return None
+
+def load_fonts(force=False):
+    """Resolve and read the font file for every script once per process."""
+    global _font_data
+    with _load_lock:
+        if _font_data is not None and not force:
+            return _font_data
+
+        font_data = {}
+        for script, candidates in FONT_CANDIDATES.items():
+            font_data[script] = None
+            for path in _configured_paths(script) + candidates:
+                data = _read_font(path)
+                if data is not None:
+                    logging.info(f"Using font {path} for {script} text")
+                    font_data[script] = data
+                    break
+            else:
+                logging.warning(f"No usable {script} font found, using Pillow's default font")
+
+        _font_data = font_data
+        if force:
+            # Faces built from the previous font files are stale now
+            get_font.cache_clear()
+        return _font_data
+
+@functools.lru_cache(maxsize=FONT_CACHE_SIZE)
+def get_font(script, size):
+    """Get a cached FreeType face for script at size. Never touches the network."""
+    font_data = load_fonts()
+    data = font_data.get(script) or font_data.get('latin')
+    if data is None:
+        return ImageFont.load_default(size)
+    return ImageFont.truetype(io.BytesIO(data), size)
+
+def font_cache_info():
+    """Return hit/miss statistics of the font cache."""
+    return get_font.cache_info()
@@ -0,0 +1,97 @@
+import os
+import json
+import random
+import logging
+import functools
+from pathlib import Path
+
+import requests
+
+from marathi_meme_generator.ratelimit import GiphyUnavailable, get_giphy_gate, retry_after_seconds
+from marathi_meme_generator.template_library import OFFLINE_MODE, get_template_library
+
+# Search endpoint, overridable to point the app at a local stub server
+GIPHY_SEARCH_URL = os.getenv("GIPHY_SEARCH_URL", "https://api.giphy.com/v1/gifs/search")
+# Results asked for per search
+GIPHY_SEARCH_LIMIT = int(os.getenv("GIPHY_SEARCH_LIMIT", "25"))
+SEARCH_TIMEOUT = float(os.getenv("MEME_SEARCH_TIMEOUT", "3"))
+# Seconds to wait for a source image to download
+DOWNLOAD_TIMEOUT = float(os.getenv("MEME_DOWNLOAD_TIMEOUT", "10"))
+
+MEME_CONFIG = Path(__file__).parent / 'meme_search_terms.json'
+
+# Default neutral memes for fallback if JSON loading fails
+DEFAULT_NEUTRAL_MEMES = [
+    "https://media.giphy.com/media/ICOgUNjpvO0PC/giphy.gif",
+    "https://media.giphy.com/media/3oKIPnAiaMCws8nOsE/giphy.gif",
+    "https://media.giphy.com/media/W3QKEujo8vztC/giphy.gif"
+]
+# Searched for emotions without search terms of their own
+DEFAULT_SEARCH_TERMS = ['meme', 'reaction']
+
+
+def load_meme_config():
+    """Load meme search terms and fallback memes from JSON file."""
+    try:
+        with open(MEME_CONFIG, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception as e:
+        logging.error(f"Error loading meme_search_terms.json: {str(e)}")
+        return {"search_terms": {}, "fallback_memes": {}}
+
+def fallback_meme(emotion, fallback_memes=None, rng=random):
+    """Pick a meme for emotion without Giphy.
+
+    Templates of the template library come first; without any, one of
+    fallback_memes (lists of URLs by emotion) or the default neutral memes.
+    Returns None offline when there are no templates.
+    """
+    library = get_template_library()
+    if library or OFFLINE_MODE:
+        return library.pick(emotion, rng)
+    fallback_memes = fallback_memes or {}
+    return rng.choice(fallback_memes.get(emotion) or fallback_memes.get('neutral') or DEFAULT_NEUTRAL_MEMES)
+
+def search_params(term, rating='g', limit=GIPHY_SEARCH_LIMIT):
+    """Return the query parameters of a Giphy search for term."""
+    return {
+        "api_key": os.getenv("GIPHY_API_KEY"),
+        "q": term,
+        "limit": limit,
+        "rating": rating,
+    }
+
+def search_result_urls(response):
+    """Return the original-size URLs of a Giphy search response.
+
+    Takes a requests or an httpx response; raises GiphyUnavailable when
+    Giphy was throttling or failing.
+    """
+    if response.status_code == 429:
+        raise GiphyUnavailable('rate_limited', retry_after_seconds(response.headers.get("Retry-After")))
+    if response.status_code >= 500:
+        raise GiphyUnavailable('error')
+    response.raise_for_status()
+    return [gif["images"]["original"]["url"] for gif in response.json()["data"]]
+
+@functools.lru_cache(maxsize=None)
+def get_http_session():
+    """Get the shared keep-alive HTTP session for searches and downloads."""
+    return requests.Session()
+
+def search_giphy(term, rating='g'):
+    """Search Giphy for term and return the original-size URLs of the results.
+
+    Raises GiphyUnavailable, without calling Giphy while the quota is used
+    up or the circuit is open, when Giphy is throttling or failing.
+    """
+    return get_giphy_gate().call(_search_giphy, term, rating)
+
+def _search_giphy(term, rating):
+    try:
+        response = get_http_session().get(GIPHY_SEARCH_URL, params=search_params(term, rating), timeout=SEARCH_TIMEOUT)
+    except requests.Timeout:
+        raise GiphyUnavailable('timeout')
+    except requests.ConnectionError:
+        raise GiphyUnavailable('error')
+    return search_result_urls(response)
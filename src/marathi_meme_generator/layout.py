@@ -0,0 +1,188 @@
+import os
+import re
+import functools
+from typing import NamedTuple
+
+from PIL import Image, ImageDraw, ImageFont
+
+from marathi_meme_generator import fonts
+
+# Number of (text, width, height, script) layouts kept in memory
+LAYOUT_CACHE_SIZE = int(os.getenv("MEME_LAYOUT_CACHE_SIZE", "256"))
+
+# Number of (font, word) measurements kept in memory
+WORD_CACHE_SIZE = int(os.getenv("MEME_WORD_CACHE_SIZE", "8192"))
+
+DEVANAGARI_PATTERN = re.compile(r'[\u0900-\u097F]')
+
+# Text measurement does not depend on the target image, so a tiny scratch
+# canvas is enough for all bbox calls
+_MEASURE_DRAW = ImageDraw.Draw(Image.new('RGBA', (1, 1)))
+
+
+class CaptionLayout(NamedTuple):
+    """Font, wrapped text and position of a caption on an image of a given size."""
+    font: ImageFont.FreeTypeFont
+    wrapped_text: str
+    line_spacing: int
+    text_width: int
+    text_height: int
+    border_height: int
+    x: float
+    y: float
+
+
+def text_script(text):
+    """Return the script used to pick a font for the text."""
+    return 'devanagari' if DEVANAGARI_PATTERN.search(text) else 'latin'
+
+
+def get_script(language):
+    """Get the caption script for a language, or None to detect it from the caption."""
+    if not language:
+        return None
+    return 'devanagari' if language == 'mr' else 'latin'
+
+
+def get_font(text, size, script=None):
+    """Get the font for text rendering from the process-wide font registry."""
+    return fonts.get_font(script or text_script(text), size)
+
+@functools.lru_cache(maxsize=WORD_CACHE_SIZE)
+def _word_metrics(font, word):
+    """Return the ink left/right edges and the advance width of word in font."""
+    left, _, right, _ = font.getbbox(word)
+    return left, right, font.getlength(word)
+
+def wrap_text(text, width, font, draw=None):
+    """Wrap text to fit within a given width.
+
+    Lines are measured from cached per-word metrics: a word starts one space
+    advance after the previous word ends, so the ink width of a line is the
+    distance from the first word's left edge to the last word's right edge.
+    draw is accepted for backwards compatibility and no longer used.
+    """
+    words = text.split()
+    lines = []
+    current_line = []
+    space_width = font.getlength(' ')
+    line_left = 0
+    line_advance = 0
+
+    for word in words:
+        left, right, advance = _word_metrics(font, word)
+        if current_line:
+            start = line_advance + space_width
+            text_width = start + right - line_left
+        else:
+            start = 0
+            text_width = right - left
+
+        if text_width > width:
+            if current_line:
+                lines.append(' '.join(current_line))
+                current_line = [word]
+                line_left = left
+                line_advance = advance
+            else:
+                lines.append(word)
+        else:
+            if not current_line:
+                line_left = left
+            current_line.append(word)
+            line_advance = start + advance
+
+    if current_line:
+        lines.append(' '.join(current_line))
+
+    return '\n'.join(lines)
+
+def _fit_font(draw, text, image_width, border_height, size, script):
+    """Return (font, text_width, text_height, wrapped_text, line_spacing) if text fits at size."""
+    font = get_font(text, size, script)
+    wrapped_text = wrap_text(text, image_width * 0.85, font)
+    num_lines = wrapped_text.count('\n') + 1
+    line_spacing = size // 4  # Reduced from 6 to 4 for tighter spacing
+    total_text_height = (size * num_lines) + (line_spacing * (num_lines - 1))
+
+    bbox = draw.multiline_textbbox((0, 0), wrapped_text, font=font, align='center', spacing=line_spacing)
+    text_width = bbox[2] - bbox[0]
+    text_height = bbox[3] - bbox[1]
+
+    if (text_width <= image_width * 0.85 and
+        text_height <= border_height * 0.85 and
+        total_text_height <= border_height * 0.85):
+        return font, text_width, text_height, wrapped_text, line_spacing
+    return None
+
+def calculate_optimal_font_size(draw, text, image_width, image_height, border_height, script=None):
+    """Calculate the optimal font size that fits the text within the image width."""
+    # Calculate font sizes based on text length and 20% of image height
+    word_count = len(text.split())
+    char_count = len(text)
+
+    # Base maximum size on border height (which is 20% of image height)
+    if word_count <= 3 and char_count <= 15:
+        max_size = min(60, border_height // 3)  # Reduced from 70 to 60
+    elif word_count <= 6 and char_count <= 30:
+        max_size = min(45, border_height // 3)  # Reduced from 55 to 45
+    else:
+        max_size = min(35, border_height // 3)  # Reduced from 45 to 35
+
+    min_size = 20  # Reduced from 25 to 20
+
+    # Candidate sizes step down by 2 for finer control. Smaller sizes only
+    # make the text narrower and shorter, so binary search for the largest fit.
+    sizes = list(range(max_size, min_size - 1, -2))
+    fits = {}
+
+    def fit(index):
+        if index not in fits:
+            try:
+                fits[index] = _fit_font(draw, text, image_width, border_height, sizes[index], script)
+            except Exception:
+                fits[index] = None
+        return fits[index]
+
+    lo, hi = 0, len(sizes) - 1
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if fit(mid):
+            hi = mid
+        else:
+            lo = mid + 1
+    if sizes and fit(lo):
+        return fit(lo)
+
+    # If no size worked, use minimum size
+    font = get_font(text, min_size, script)
+    wrapped_text = wrap_text(text, image_width * 0.85, font)
+    bbox = draw.multiline_textbbox((0, 0), wrapped_text, font=font, align='center')
+    line_spacing = min_size // 4  # Reduced from 6 to 4
+    return font, bbox[2] - bbox[0], bbox[3] - bbox[1], wrapped_text, line_spacing
+
+
+@functools.lru_cache(maxsize=LAYOUT_CACHE_SIZE)
+def _compute_caption_layout(text, width, height, script):
+    border_height = int(height * 0.20)
+    font, text_width, text_height, wrapped_text, line_spacing = calculate_optimal_font_size(
+        _MEASURE_DRAW, text, width, height, border_height, script
+    )
+
+    # Center text in the border area with more padding at the bottom
+    x = (width - text_width) / 2
+    y = (height - border_height) + ((border_height - text_height) / 2) - 5  # Added -5 for better bottom padding
+
+    return CaptionLayout(font, wrapped_text, line_spacing, text_width, text_height,
+                         border_height, x, y)
+
+def get_caption_layout(text, width, height, script=None):
+    """Get the caption layout for text on an image of the given size (memoized).
+
+    script overrides the font choice; by default it is detected from the text.
+    """
+    return _compute_caption_layout(text, width, height, script or text_script(text))
+
+def layout_cache_info():
+    """Return hit/miss statistics of the layout cache."""
+    return _compute_caption_layout.cache_info()
@@ -0,0 +1,167 @@
+from collections import deque
+from typing import NamedTuple
+
+# Words that mark a caption as flirting wherever they appear inside a word
+FLIRT_MARKERS = ('qt', 'cute')
+
+
+class Lexicon(NamedTuple):
+    """Emotion word lists and phrases compiled into one Aho-Corasick automaton."""
+    goto: list
+    fail: list
+    outputs: list
+    patterns: list
+    word_emotions: list  # pattern id -> emotions it counts for when found inside a word
+    phrase_emotions: list  # pattern id -> emotions it counts for when found anywhere
+    flirt_markers: frozenset  # pattern ids of FLIRT_MARKERS
+    emotions: tuple  # emotion word lists, in priority order for ties
+    phrase_order: tuple  # phrase emotions, in lookup order
+    roast_words: frozenset
+
+
+class LexiconMatches(NamedTuple):
+    """All lexicon hits in one text."""
+    word_hits: set  # (word number, pattern id) for patterns found inside a single word
+    phrase_emotions: set  # emotions with at least one phrase in the text
+    has_flirt_marker: bool
+
+
+def build_automaton(patterns):
+    """Build goto, fail and output tables matching all patterns in one pass."""
+    goto = [{}]
+    outputs = [[]]
+    for pattern_id, pattern in enumerate(patterns):
+        node = 0
+        for char in pattern:
+            if char not in goto[node]:
+                goto.append({})
+                outputs.append([])
+                goto[node][char] = len(goto) - 1
+            node = goto[node][char]
+        outputs[node].append(pattern_id)
+
+    fail = [0] * len(goto)
+    queue = deque(goto[0].values())
+    while queue:
+        node = queue.popleft()
+        for char, child in goto[node].items():
+            queue.append(child)
+            state = fail[node]
+            while state and char not in goto[state]:
+                state = fail[state]
+            fail[child] = goto[state].get(char, 0)
+            if fail[child] == child:
+                fail[child] = 0
+            outputs[child] = outputs[child] + outputs[fail[child]]
+
+    return goto, fail, [tuple(out) for out in outputs]
+
+def compile_lexicon(emotion_words, emotion_phrases):
+    """Compile {emotion: words} and {emotion: phrases} into a Lexicon."""
+    pattern_ids = {}
+    patterns = []
+    word_emotions = []
+    phrase_emotions = []
+
+    def add(pattern):
+        if pattern not in pattern_ids:
+            pattern_ids[pattern] = len(patterns)
+            patterns.append(pattern)
+            word_emotions.append([])
+            phrase_emotions.append([])
+        return pattern_ids[pattern]
+
+    for emotion, words in emotion_words.items():
+        for word in words:
+            # A pattern with whitespace can never be found inside a single
+            # word, and an empty one would match everything
+            if word and not any(char.isspace() for char in word):
+                pattern_id = add(word)
+                if emotion not in word_emotions[pattern_id]:
+                    word_emotions[pattern_id].append(emotion)
+
+    for emotion, phrases in emotion_phrases.items():
+        for phrase in phrases:
+            if phrase:
+                phrase_emotions[add(phrase)].append(emotion)
+
+    flirt_markers = frozenset(add(marker) for marker in FLIRT_MARKERS)
+
+    goto, fail, outputs = build_automaton(patterns)
+    return Lexicon(
+        goto=goto,
+        fail=fail,
+        outputs=outputs,
+        patterns=patterns,
+        word_emotions=[tuple(emotions) for emotions in word_emotions],
+        phrase_emotions=[tuple(emotions) for emotions in phrase_emotions],
+        flirt_markers=flirt_markers,
+        emotions=tuple(emotion_words),
+        phrase_order=tuple(emotion_phrases),
+        roast_words=frozenset(emotion_words.get('roast', ())),
+    )
+
+def find_matches(lexicon, text):
+    """Scan lowercased text once and collect every lexicon hit."""
+    goto, fail, outputs = lexicon.goto, lexicon.fail, lexicon.outputs
+    word_hits = set()
+    phrase_emotions = set()
+    has_flirt_marker = False
+
+    node = 0
+    word_number = -1
+    in_word = False
+    for char in text:
+        # Word numbers follow str.split(), which splits on any whitespace
+        if char.isspace():
+            in_word = False
+        elif not in_word:
+            in_word = True
+            word_number += 1
+
+        while node and char not in goto[node]:
+            node = fail[node]
+        node = goto[node].get(char, 0)
+
+        for pattern_id in outputs[node]:
+            if lexicon.phrase_emotions[pattern_id]:
+                phrase_emotions.update(lexicon.phrase_emotions[pattern_id])
+            if lexicon.word_emotions[pattern_id]:
+                word_hits.add((word_number, pattern_id))
+            if pattern_id in lexicon.flirt_markers:
+                has_flirt_marker = True
+
+    return LexiconMatches(word_hits, phrase_emotions, has_flirt_marker)
+
+def detect_emotion(lexicon, text):
+    """Return the emotion for text, or 'neutral' when nothing matches.
+
+    Priority is roast words, flirt markers, phrases, then the emotion whose
+    words appear most often (ties go to the earlier emotion).
+    """
+    matches = find_matches(lexicon, text.lower())
+
+    # Roast words have the highest priority
+    for _, pattern_id in matches.word_hits:
+        if 'roast' in lexicon.word_emotions[pattern_id]:
+            return 'roast'
+
+    # 'qt'/'cute' anywhere in a word means flirting. This also covers the
+    # khup/khoop + cute/qt combination.
+    if matches.has_flirt_marker:
+        return 'flirt'
+
+    for emotion in lexicon.phrase_order:
+        if emotion in matches.phrase_emotions:
+            return emotion
+
+    # Each distinct emotion word found inside a word counts once per word
+    emotion_counts = dict.fromkeys(lexicon.emotions, 0)
+    for _, pattern_id in matches.word_hits:
+        for emotion in lexicon.word_emotions[pattern_id]:
+            emotion_counts[emotion] += 1
+
+    best = max(emotion_counts.values(), default=0)
+    if not best:
+        return 'neutral'
+    return next(emotion for emotion, count in emotion_counts.items() if count == best)
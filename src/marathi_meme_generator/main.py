@@ -1,20 +1,105 @@
 import os
-import random
-import requests
+import json
+import time
+import base64
+import asyncio
+import functools
+import httpx
 from fastapi import FastAPI, HTTPException
-from fastapi.responses import HTMLResponse, Response
+from fastapi.responses import HTMLResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi import Request
-from PIL import Image, ImageDraw, ImageFont
-import io
+from contextlib import asynccontextmanager
+from typing import List, Optional
+from urllib.parse import urlparse
 from dotenv import load_dotenv
 from pydantic import BaseModel
+from marathi_meme_generator import fonts, giphy, metrics, sentiment
+from marathi_meme_generator.blob_cache import get_blob_cache
+from marathi_meme_generator.coalesce import SingleFlight, flight_key
+from marathi_meme_generator.giphy import (
+    DOWNLOAD_TIMEOUT,
+    GIPHY_SEARCH_URL,
+    SEARCH_TIMEOUT,
+    search_params,
+    search_result_urls,
+)
+from marathi_meme_generator.layout import get_script
+from marathi_meme_generator.ratelimit import GiphyUnavailable, SearchBatcher, get_giphy_gate
+from marathi_meme_generator.render import RenderBudgetError, init_worker, render_source, size_target
+from marathi_meme_generator.sentiment import analyze_sentiment_batch, normalize_text
+from marathi_meme_generator.scheduler import DeadlineExceeded, Overloaded, RenderScheduler, WorkerCrashed
+from marathi_meme_generator.result_cache import RenderedMeme, get_result_cache, result_key
+from marathi_meme_generator.template_library import OFFLINE_MODE, get_template_library, is_template_url
 
 # Load environment variables
 load_dotenv()
 
-app = FastAPI()
+# Per-stage timeouts in seconds; searches take MEME_SEARCH_TIMEOUT
+CONNECT_TIMEOUT = float(os.getenv("MEME_CONNECT_TIMEOUT", "2"))
+
+# Connection pool and concurrency limits
+HTTP_MAX_CONNECTIONS = int(os.getenv("MEME_HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("MEME_HTTP_MAX_KEEPALIVE", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("MEME_HTTP_KEEPALIVE_EXPIRY", "30"))
+MAX_CONCURRENT_DOWNLOADS = int(os.getenv("MEME_MAX_CONCURRENT_DOWNLOADS", "32"))
+
+# Render worker processes, renders allowed to wait for one, and how long a
+# request may take in total before it is given up
+RENDER_WORKERS = int(os.getenv("MEME_RENDER_WORKERS", str(os.cpu_count() or 2)))
+RENDER_QUEUE_SIZE = int(os.getenv("MEME_RENDER_QUEUE_SIZE", str(RENDER_WORKERS * 4)))
+REQUEST_DEADLINE = float(os.getenv("MEME_REQUEST_DEADLINE", "15"))
+# Most queries in one /search/batch request, and how many of them render at once
+BATCH_MAX_ITEMS = int(os.getenv("MEME_BATCH_MAX_ITEMS", "1000"))
+BATCH_CONCURRENCY = int(os.getenv("MEME_BATCH_CONCURRENCY", str(RENDER_WORKERS)))
+
+# Hosts a client may name as the source image of a meme
+SOURCE_HOSTS = tuple(
+    host.strip() for host in os.getenv("MEME_SOURCE_HOSTS", "giphy.com,memegen.link").split(",") if host.strip()
+)
+# How long clients may reuse a meme rendered from a source they picked themselves
+RESULT_MAX_AGE = int(os.getenv("MEME_RESULT_MAX_AGE", "86400"))
+# Send animations as WebP to clients that accept it
+ANIMATED_WEBP = os.getenv("MEME_ANIMATED_WEBP", "true").lower() in ("1", "true", "yes")
+
+@asynccontextmanager
+async def lifespan(app):
+    # Resolve and read font files once, before serving any request
+    fonts.load_fonts()
+    # Lexicons too, so the first /search/batch does not pay for loading NLTK
+    await asyncio.to_thread(sentiment.warm_up)
+    # And the template library, which fallback memes are rendered from
+    await asyncio.to_thread(get_template_library)
+
+    # One pooled keep-alive client for every upstream call
+    app.state.http = httpx.AsyncClient(
+        timeout=httpx.Timeout(DOWNLOAD_TIMEOUT, connect=CONNECT_TIMEOUT),
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+        ),
+        follow_redirects=True,
+    )
+    # Pillow work runs in warm worker processes so it never blocks the event loop
+    app.state.scheduler = RenderScheduler(
+        RENDER_WORKERS, RENDER_QUEUE_SIZE, initializer=init_worker
+    )
+    app.state.download_limit = asyncio.Semaphore(MAX_CONCURRENT_DOWNLOADS)
+    # Identical requests in flight share one search, download and render;
+    # through MEME_COALESCE_LOCK_DIR across server processes as well
+    app.state.meme_flights = SingleFlight('meme', encode=encode_meme, decode=decode_meme)
+    app.state.download_flights = SingleFlight('download', lock_dir='')
+    # Giphy searches go through the quota and circuit breaker, batched per loop pass
+    app.state.giphy_searches = SearchBatcher(functools.partial(search_giphy, app.state.http), get_giphy_gate())
+    try:
+        yield
+    finally:
+        await app.state.http.aclose()
+        app.state.scheduler.shutdown()
+
+app = FastAPI(lifespan=lifespan)
 
 # Mount static files
 app.mount("/static", StaticFiles(directory="static"), name="static")
@@ -22,7 +107,7 @@ app.mount("/static", StaticFiles(directory="static"), name="static")
 # Templates
 templates = Jinja2Templates(directory="templates")
 
-# Default memes 
+# Default memes
 # TODO - Add more memes
 DEFAULT_MEMES = [
     "https://api.memegen.link/images/doge/such_meme/very_app.png",
@@ -33,97 +118,346 @@ DEFAULT_MEMES = [
 class SearchQuery(BaseModel):
     text: str
     language: str = "en"  # Default to English
+    source_url: Optional[str] = None  # Reuse the image returned in X-Meme-Source
+    size: Optional[str] = None  # Size tier: thumb, small, medium, large or original
+    max_dimension: Optional[int] = None  # Longest side of the meme, in pixels
+
+class BatchQuery(BaseModel):
+    items: List[SearchQuery]
+    concurrency: Optional[int] = None  # Capped at MEME_BATCH_CONCURRENCY
+
+def fallback_meme(text, reason):
+    """Pick a meme without Giphy, from the template library when it has any."""
+    metrics.increment('meme_giphy_fallbacks_total', reason=reason)
+    meme = giphy.fallback_meme(sentiment.analyze_sentiment(text), {'neutral': DEFAULT_MEMES})
+    if meme is None:
+        raise HTTPException(status_code=503, detail="No meme templates available offline")
+    return meme
+
+async def search_giphy(client, text):
+    """Search Giphy for text and return the URLs of the results.
+
+    Raises GiphyUnavailable when Giphy is throttling, timing out or failing.
+    """
+    try:
+        with metrics.span('search'):
+            response = await client.get(GIPHY_SEARCH_URL, params=search_params(text, limit=1), timeout=SEARCH_TIMEOUT)
+    except httpx.TimeoutException:
+        raise GiphyUnavailable('timeout')
+    except httpx.TransportError:
+        raise GiphyUnavailable('error')
+    return search_result_urls(response)
+
+async def get_giphy_meme(text):
+    """Fetch a random meme from Giphy based on the input text.
 
-def get_giphy_meme(text):
-    """Fetch a random meme from Giphy based on the input text."""
+    While the Giphy quota is used up or its circuit is open, the fallback
+    is picked straight away, without a round trip.
+    """
+    if OFFLINE_MODE:
+        return fallback_meme(text, 'offline')
     api_key = os.getenv("GIPHY_API_KEY")
     if not api_key:
-        return random.choice(DEFAULT_MEMES)
-    
-    url = f"https://api.giphy.com/v1/gifs/search"
-    params = {
-        "api_key": api_key,
-        "q": text,
-        "limit": 1,
-        "rating": "g"
-    }
-    
+        return fallback_meme(text, 'no_api_key')
+
     try:
-        response = requests.get(url, params=params)
-        response.raise_for_status()
-        data = response.json()
-        
-        if data["data"]:
-            return data["data"][0]["images"]["original"]["url"]
-        return random.choice(DEFAULT_MEMES)
+        urls = await app.state.giphy_searches.search(text)
+    except GiphyUnavailable as e:
+        return fallback_meme(text, e.reason)
     except Exception:
-        return random.choice(DEFAULT_MEMES)
+        return fallback_meme(text, 'error')
+    if urls:
+        return urls[0]
+    return fallback_meme(text, 'no_results')
 
-def get_font(language):
-    """Get the appropriate font based on language."""
-    try:
-        if language == "mr":  # Marathi
-            return ImageFont.truetype("static/fonts/NotoSansMarathi-Regular.ttf", 40)
-        else:  # English
-            return ImageFont.truetype("arial.ttf", 40)
-    except:
-        return ImageFont.load_default()
-
-def add_text_to_image(image_url, text, language="en"):
-    """Download image and add text to it."""
+def is_allowed_source(url):
+    """Check that a client supplied source URL points at a known image host or template."""
+    if is_template_url(url):
+        return url in get_template_library()
+    if OFFLINE_MODE:
+        return False
+    parsed = urlparse(url)
+    host = (parsed.hostname or "").lower()
+    return parsed.scheme in ("http", "https") and any(
+        host == allowed or host.endswith("." + allowed) for allowed in SOURCE_HOSTS
+    )
+
+def etag_matches(if_none_match, etag):
+    """Check an If-None-Match header against an ETag."""
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate in ("*", etag):
+            return True
+    return False
+
+def get_animated_format(accept):
+    """Pick the format animations are encoded in from an Accept header."""
+    if ANIMATED_WEBP and "image/webp" in (accept or ""):
+        return "webp"
+    return "gif"
+
+async def download_image(client, image_url):
+    """Return the blob cache record of the source image, downloading it only when needed."""
+    blob_cache = get_blob_cache()
+    record = blob_cache.lookup(image_url)
+    if record and blob_cache.is_fresh(record):
+        blob_cache.count('hits')
+        return record
+
+    async with app.state.download_limit:
+        try:
+            with metrics.span('download'):
+                response = await client.get(
+                    image_url, headers=blob_cache.conditional_headers(record), timeout=DOWNLOAD_TIMEOUT
+                )
+            if not (response.status_code == 304 and record):
+                response.raise_for_status()
+        except httpx.TimeoutException:
+            raise HTTPException(status_code=504, detail=f"Timed out downloading {image_url}")
+        except httpx.HTTPError as e:
+            raise HTTPException(status_code=502, detail=str(e))
+
+    # Disk writes (and eviction scans) stay off the event loop
+    if response.status_code == 304:
+        blob_cache.count('revalidated')
+        return await asyncio.to_thread(blob_cache.revalidated, image_url, record, response.headers)
+    blob_cache.count('misses')
+    metrics.increment('meme_bytes_total', len(response.content), direction='in')
+    return await asyncio.to_thread(blob_cache.store, image_url, response.content, response.headers)
+
+async def add_text_to_image(client, image_url, text, language="en", animated_format="gif", deadline=None, target=None):
+    """Download image and add text to it in a render worker.
+
+    Returns the encoded image bytes and their media type.
+    """
+    record = await download_image(client, image_url)
+    return await render_record(record, text, language, animated_format, deadline, target)
+
+async def render_record(record, text, language="en", animated_format="gif", deadline=None, target=None):
+    """Add text to a downloaded image (or a template:// URL) in a render worker."""
     try:
-        # Download image
-        response = requests.get(image_url)
-        response.raise_for_status()
-        image = Image.open(io.BytesIO(response.content))
-        
-        # Create drawing object
-        draw = ImageDraw.Draw(image)
-        
-        # Get appropriate font
-        font = get_font(language)
-        
-        # Add text to image
-        text_width, text_height = draw.textsize(text, font=font)
-        x = (image.width - text_width) / 2
-        y = image.height - text_height - 20
-        
-        # Add text with outline for better visibility
-        outline_color = "black"
-        text_color = "white"
-        
-        # Draw outline
-        for offset in [(1,1), (-1,1), (1,-1), (-1,-1)]:
-            draw.text((x + offset[0], y + offset[1]), text, font=font, fill=outline_color)
-        
-        # Draw main text
-        draw.text((x, y), text, font=font, fill=text_color)
-        
-        # Save to bytes
-        img_byte_arr = io.BytesIO()
-        image.save(img_byte_arr, format='PNG')
-        img_byte_arr.seek(0)
-        
-        return img_byte_arr
+        # The worker's decode / layout / draw / encode spans come back with the result
+        with metrics.span('render'):
+            result, spans = await app.state.scheduler.run(
+                metrics.call_traced, render_source, record, text, get_script(language),
+                animated_format, target, deadline=deadline
+            )
+        metrics.add_spans(spans)
+        return result
+    except (Overloaded, WorkerCrashed) as e:
+        raise HTTPException(
+            status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)}
+        )
+    except DeadlineExceeded as e:
+        raise HTTPException(
+            status_code=503, detail=str(e),
+            headers={"Retry-After": str(app.state.scheduler.retry_after())}
+        )
+    except RenderBudgetError as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+async def _shared(tasks, key, fn, *args):
+    """Await fn(*args), running it once per key for everyone sharing tasks.
+
+    Failed runs are forgotten, so a later caller tries again.
+    """
+    if tasks is None:
+        return await fn(*args)
+    if key not in tasks:
+        task = asyncio.ensure_future(fn(*args))
+        task.add_done_callback(
+            lambda done: tasks.pop(key, None) if done.cancelled() or done.exception() else None
+        )
+        tasks[key] = task
+    return await asyncio.shield(tasks[key])
+
+def encode_meme(result):
+    """Turn a (source URL, RenderedMeme) result into bytes other processes can read."""
+    meme_url, meme = result
+    header = json.dumps({"source_url": meme_url, "media_type": meme.media_type, "etag": meme.etag})
+    return header.encode("utf-8") + b"\n" + meme.content
+
+def decode_meme(data):
+    header, _, content = data.partition(b"\n")
+    fields = json.loads(header)
+    return fields["source_url"], RenderedMeme(content, fields["media_type"], fields["etag"])
+
+async def generate_meme(query, animated_format, deadline, shared=None):
+    """Pick the source image for a query and render its meme.
+
+    Returns the source URL and the RenderedMeme. Concurrent queries for the
+    same caption, language, source and output share one run and get the
+    same meme. shared is a dict that queries of one batch pass along to run
+    each Giphy search, download and render only once.
+    """
+    try:
+        target = size_target(query.size, query.max_dimension)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if query.source_url and not is_allowed_source(query.source_url):
+        raise HTTPException(status_code=400, detail="Unsupported source_url")
+
+    text = normalize_text(query.text)
+    key = flight_key(text, query.language, query.source_url or "", animated_format, target.cache_key())
+    return await app.state.meme_flights.run(
+        key, _generate_meme, text, query, animated_format, deadline, target, shared
+    )
+
+async def _generate_meme(text, query, animated_format, deadline, target, shared):
+    # Get meme image URL
+    if query.source_url:
+        meme_url = query.source_url
+    else:
+        meme_url = await _shared(shared, ('search', text), get_giphy_meme, text)
+
+    # Identical inputs render identical bytes, so reuse them when we can
+    result_cache = get_result_cache()
+    key = result_key(meme_url, text, query.language, animated_format, target.cache_key())
+    meme = result_cache.peek(key)
+    if meme is None:
+        # Reading a spilled result (and the spills reloading it causes) stays off the event loop
+        meme = await asyncio.to_thread(result_cache.get, key)
+    metrics.increment('meme_cache_total', cache='result', result='misses' if meme is None else 'hits')
+    if meme is None:
+        if is_template_url(meme_url):
+            # Templates are decoded in every worker already, there is nothing to download
+            record = meme_url
+        else:
+            record = await app.state.download_flights.run(meme_url, download_image, app.state.http, meme_url)
+        content, media_type = await _shared(
+            shared, ('render', key), render_record,
+            record, text, query.language, animated_format, deadline, target
+        )
+        # Putting may spill older results to disk, which stays off the event loop
+        meme = await asyncio.to_thread(result_cache.put, key, content, media_type)
+    return meme_url, meme
+
 @app.get("/", response_class=HTMLResponse)
 async def read_root(request: Request):
     return templates.TemplateResponse("index.html", {"request": request})
 
 @app.post("/search")
-async def search_meme(query: SearchQuery):
+async def search_meme(query: SearchQuery, request: Request):
     """
     Search for a meme based on the input text and return the generated meme.
     """
     if not query.text:
         raise HTTPException(status_code=400, detail="Text cannot be empty")
-    
-    # Get meme image URL
-    meme_url = get_giphy_meme(query.text)
-    
-    # Add text to image
-    image_bytes = add_text_to_image(meme_url, query.text, query.language)
-    
-    return Response(content=image_bytes.getvalue(), media_type="image/png") 
\ No newline at end of file
+    deadline = time.monotonic() + REQUEST_DEADLINE
+    animated_format = get_animated_format(request.headers.get("Accept"))
+    with metrics.trace("/search"):
+        meme_url, meme = await generate_meme(query, animated_format, deadline)
+
+    # A random pick may differ next time, so only explicit sources are cacheable
+    headers = {
+        "ETag": meme.etag,
+        "X-Meme-Source": meme_url,
+        "Cache-Control": f"public, max-age={RESULT_MAX_AGE}" if query.source_url else "no-cache",
+        "Vary": "Accept",
+    }
+    if etag_matches(request.headers.get("If-None-Match"), meme.etag):
+        return Response(status_code=304, headers=headers)
+    metrics.increment('meme_bytes_total', len(meme.content), direction='out')
+    return Response(content=meme.content, media_type=meme.media_type, headers=headers)
+
+@app.post("/search/batch")
+async def search_batch(batch: BatchQuery, request: Request):
+    """
+    Generate memes for many queries, streamed back as NDJSON as they finish.
+
+    Each line carries the index of its query, the detected emotion and
+    either the base64 encoded meme or the status and detail of its error.
+    """
+    if not batch.items:
+        raise HTTPException(status_code=400, detail="Items cannot be empty")
+    if len(batch.items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_ITEMS} items per batch")
+    animated_format = get_animated_format(request.headers.get("Accept"))
+    limit = asyncio.Semaphore(max(1, min(batch.concurrency or BATCH_CONCURRENCY, BATCH_CONCURRENCY)))
+    shared = {}
+
+    # One pass over every caption, off the event loop
+    with metrics.span('sentiment'):
+        emotions = await asyncio.to_thread(analyze_sentiment_batch, [item.text for item in batch.items])
+
+    async def generate(index, query):
+        result = {"index": index, "emotion": emotions[index]}
+        async with limit:
+            deadline = time.monotonic() + REQUEST_DEADLINE
+            while True:
+                try:
+                    if not query.text:
+                        raise HTTPException(status_code=400, detail="Text cannot be empty")
+                    meme_url, meme = await generate_meme(query, animated_format, deadline, shared)
+                    break
+                except HTTPException as e:
+                    # Wait out a full render queue while the deadline allows
+                    retry_after = int((e.headers or {}).get("Retry-After", 0))
+                    if e.status_code == 503 and retry_after and time.monotonic() + retry_after < deadline:
+                        await asyncio.sleep(retry_after)
+                        continue
+                    result.update(status=e.status_code, detail=e.detail)
+                    return result
+        metrics.increment('meme_bytes_total', len(meme.content), direction='out')
+        result.update(
+            status=200,
+            source_url=meme_url,
+            media_type=meme.media_type,
+            etag=meme.etag,
+            content=base64.b64encode(meme.content).decode("ascii"),
+        )
+        return result
+
+    async def stream():
+        tasks = [asyncio.create_task(generate(index, query)) for index, query in enumerate(batch.items)]
+        try:
+            for finished in asyncio.as_completed(tasks):
+                yield json.dumps(await finished, ensure_ascii=False) + "\n"
+        finally:
+            # The client went away, or we are done: stop whatever is left
+            for task in tasks:
+                task.cancel()
+            for task in list(shared.values()):
+                task.cancel()
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Expose stage timings, cache counters, render queue depth and Giphy limits to Prometheus."""
+    scheduler = app.state.scheduler.stats()
+    giphy = get_giphy_gate().stats()
+    gauges = {
+        'meme_render_queued': ("Renders waiting for a worker.", scheduler['queued']),
+        'meme_render_running': ("Renders in progress.", scheduler['running']),
+        'meme_giphy_circuit_open': (
+            "1 while the circuit breaker refuses Giphy searches.", int(giphy['state'] == 'open')
+        ),
+    }
+    if giphy['tokens'] is not None:
+        gauges['meme_giphy_tokens'] = ("Giphy searches the token bucket allows right now.", giphy['tokens'])
+    return Response(
+        content=metrics.get_registry().exposition(gauges),
+        media_type="text/plain; version=0.0.4; charset=utf-8",
+    )
+
+@app.get("/stats")
+async def render_stats():
+    """Report render queue depth, wait times and cache hit counts."""
+    return {
+        "render": app.state.scheduler.stats(),
+        "result_cache": get_result_cache().stats(),
+        "blob_cache": get_blob_cache().stats(),
+        "templates": get_template_library().stats(),
+        "giphy": dict(get_giphy_gate().stats(), batches=app.state.giphy_searches.stats()),
+        "coalescing": {
+            "meme": app.state.meme_flights.stats(),
+            "download": app.state.download_flights.stats(),
+        },
+    }
@@ -0,0 +1,208 @@
+import os
+import time
+import bisect
+import logging
+import threading
+import contextvars
+
+# Record stage timings and counters; when off every hook is a no-op
+METRICS_ENABLED = os.getenv("MEME_METRICS", "true").lower() in ("1", "true", "yes")
+# Requests slower than this are logged with their stage breakdown; 0 turns the log off
+SLOW_REQUEST_MS = float(os.getenv("MEME_SLOW_REQUEST_MS", "0"))
+
+# Upper bounds of the histogram buckets, in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+METRICS = {
+    'meme_stage_seconds': ('histogram', "Time spent in each stage of making a meme."),
+    'meme_request_seconds': ('histogram', "Time spent serving a meme request, by route."),
+    'meme_cache_total': ('counter', "Cache lookups, by cache and result."),
+    'meme_giphy_fallbacks_total': ('counter', "Memes taken from the fallback list instead of GIPHY, by reason."),
+    'meme_bytes_total': ('counter', "Image bytes downloaded (in) and sent to clients (out)."),
+    'meme_coalesced_total': ('counter', "Requests served by an identical one already in flight, by flight and scope."),
+}
+
+# Spans of the request being served, (stage, seconds) in the order they ended
+_current_trace = contextvars.ContextVar('meme_trace', default=None)
+
+
+class _Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+
+class Registry:
+    """Histograms and counters of this process, keyed by name and labels."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = _Histogram()
+            histogram.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+            histogram.sum += seconds
+            histogram.count += 1
+
+    def increment(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def exposition(self, gauges=None):
+        """Return every metric in the Prometheus text format.
+
+        gauges maps extra gauge names to (help, value), for values read at
+        scrape time.
+        """
+        with self._lock:
+            histograms = {key: (list(h.counts), h.sum, h.count) for key, h in self._histograms.items()}
+            counters = dict(self._counters)
+
+        lines = []
+        for name, (kind, help_text) in METRICS.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind == 'histogram':
+                for (metric, labels), (counts, total, count) in sorted(histograms.items()):
+                    if metric != name:
+                        continue
+                    cumulative = 0
+                    for bound, bucket in zip(BUCKETS + (float('inf'),), counts):
+                        cumulative += bucket
+                        le = '+Inf' if bound == float('inf') else repr(bound)
+                        lines.append(f"{name}_bucket{_labels(labels + (('le', le),))} {cumulative}")
+                    lines.append(f"{name}_sum{_labels(labels)} {total}")
+                    lines.append(f"{name}_count{_labels(labels)} {count}")
+            else:
+                for (metric, labels), value in sorted(counters.items()):
+                    if metric == name:
+                        lines.append(f"{name}{_labels(labels)} {value}")
+        for name, (help_text, value) in (gauges or {}).items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value}")
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels) + '}'
+
+_registry = Registry()
+
+def get_registry():
+    """Get the metrics registry of this process."""
+    return _registry
+
+
+def increment(name, amount=1, **labels):
+    """Add amount to a counter."""
+    if METRICS_ENABLED:
+        _registry.increment(name, amount, **labels)
+
+def record_span(stage, seconds):
+    """Record a finished stage in its histogram and the current request's trace."""
+    _registry.observe('meme_stage_seconds', seconds, stage=stage)
+    spans = _current_trace.get()
+    if spans is not None:
+        spans.append((stage, seconds))
+
+
+class _Span:
+    __slots__ = ('stage', 'start')
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        record_span(self.stage, time.perf_counter() - self.start)
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+_NO_SPAN = _NoSpan()
+
+def span(stage):
+    """Time a stage of making a meme: `with span('download'): ...`."""
+    return _Span(stage) if METRICS_ENABLED else _NO_SPAN
+
+
+class trace:
+    """Collect the spans of one request and time the request as a whole.
+
+    Requests slower than MEME_SLOW_REQUEST_MS are logged with the time
+    spent in each stage.
+    """
+
+    def __init__(self, route):
+        self.route = route
+        self.spans = []
+
+    def __enter__(self):
+        if METRICS_ENABLED:
+            self._token = _current_trace.set(self.spans)
+            self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if not METRICS_ENABLED:
+            return False
+        elapsed = time.perf_counter() - self._start
+        try:
+            _current_trace.reset(self._token)
+        except ValueError:
+            # Left from another context, e.g. a generator closed elsewhere
+            pass
+        _registry.observe('meme_request_seconds', elapsed, route=self.route)
+        if SLOW_REQUEST_MS and elapsed * 1000 >= SLOW_REQUEST_MS:
+            logging.warning(f"Slow request {self.route} took {elapsed * 1000:.0f} ms: {breakdown(self.spans)}")
+        return False
+
+
+def breakdown(spans):
+    """Format spans as the total time per stage, in the order stages first ended."""
+    totals = {}
+    for stage, seconds in spans:
+        totals[stage] = totals.get(stage, 0.0) + seconds
+    return ', '.join(f"{stage} {seconds * 1000:.0f} ms" for stage, seconds in totals.items()) or 'no stages'
+
+def call_traced(fn, *args):
+    """Call fn(*args) and return its result with the spans it recorded.
+
+    For functions run in worker processes, whose spans would otherwise stay
+    in the worker; pass the spans to add_spans in the calling process.
+    """
+    spans = []
+    token = _current_trace.set(spans)
+    try:
+        return fn(*args), spans
+    finally:
+        _current_trace.reset(token)
+
+def add_spans(spans):
+    """Record spans returned by call_traced as if they ran in this process."""
+    for stage, seconds in spans:
+        record_span(stage, seconds)
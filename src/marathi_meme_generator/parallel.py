@@ -0,0 +1,134 @@
+import os
+import functools
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+
+from PIL import Image
+
+from marathi_meme_generator.caption import apply_caption, get_caption_sprite
+from marathi_meme_generator.encode import encode_region
+
+# Processes captioning and quantizing animation frames; 0 keeps rendering serial
+PARALLEL_WORKERS = int(os.getenv("MEME_PARALLEL_WORKERS", "0"))
+# Animations with fewer pixels over all frames are not worth the hand-off
+PARALLEL_MIN_PIXELS = int(os.getenv("MEME_PARALLEL_MIN_PIXELS", str(20 * 1000 * 1000)))
+PARALLEL_CHUNK_FRAMES = int(os.getenv("MEME_PARALLEL_CHUNK_FRAMES", "16"))
+
+
+def use_parallel(n_frames, size):
+    """Check whether an animation is large enough to render in the frame pool."""
+    return PARALLEL_WORKERS > 0 and n_frames * size[0] * size[1] >= PARALLEL_MIN_PIXELS
+
+@functools.lru_cache(maxsize=None)
+def _get_frame_pool(workers):
+    # Spawned rather than forked, the server process runs threads
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+def get_frame_pool():
+    """Get the process pool frames are rendered in."""
+    return _get_frame_pool(PARALLEL_WORKERS)
+
+
+def _encode_chunk(shm_name, size, count, text, script, palette, caption_top, transparent):
+    """Caption and quantize count RGBA frames stored back to back in shared memory.
+
+    The first frame is the one before the chunk and is only used as the
+    reference of the second. Returns one encode_region result per other frame.
+    """
+    frame_bytes = size[0] * size[1] * 4
+    sprite = get_caption_sprite(text, size[0], size[1], script)
+    shm = SharedMemory(name=shm_name)
+    try:
+        previous = None
+        regions = []
+        for index in range(count):
+            with shm.buf[index * frame_bytes:(index + 1) * frame_bytes] as view:
+                frame = apply_caption(Image.frombytes('RGBA', size, view), sprite)
+            if previous is not None:
+                regions.append(encode_region(previous, frame, palette, caption_top, transparent))
+            previous = frame
+        return regions
+    finally:
+        shm.close()
+
+
+class _Chunk:
+    """Frames of one unit of work, copied into a shared memory block."""
+
+    def __init__(self, previous, size):
+        self.frame_bytes = size[0] * size[1] * 4
+        self.shm = SharedMemory(create=True, size=self.frame_bytes * (PARALLEL_CHUNK_FRAMES + 1))
+        self.durations = []
+        self.count = 0
+        self.future = None
+        self.append(previous)
+
+    def append(self, frame, duration=None):
+        start = self.count * self.frame_bytes
+        self.shm.buf[start:start + self.frame_bytes] = frame.tobytes()
+        self.count += 1
+        if duration is not None:
+            self.durations.append(duration)
+
+    @property
+    def full(self):
+        return self.count > PARALLEL_CHUNK_FRAMES
+
+    def release(self):
+        self.shm.close()
+        self.shm.unlink()
+
+
+def add_frames(writer, frames, previous, text, script=None):
+    """Caption (RGBA frame, duration) pairs in the frame pool and add them to writer.
+
+    previous is the uncaptioned frame before the first of frames. Frames are
+    copied into shared memory in chunks, so no pixel data is pickled, and
+    only a few chunks per worker are in flight at any time. Results are
+    added to writer in their original order.
+    """
+    pool = get_frame_pool()
+    size = previous.size
+    in_flight = deque()
+
+    def submit(chunk):
+        chunk.future = pool.submit(
+            _encode_chunk, chunk.shm.name, size, chunk.count, text, script,
+            writer.palette, writer.caption_top, writer.transparent
+        )
+        in_flight.append(chunk)
+
+    def drain_one():
+        chunk = in_flight.popleft()
+        try:
+            regions = chunk.future.result()
+        finally:
+            chunk.release()
+        for region, duration in zip(regions, chunk.durations):
+            writer.add_region(region, duration)
+
+    chunk = None
+    try:
+        for frame, duration in frames:
+            if chunk is None:
+                chunk = _Chunk(previous, size)
+            chunk.append(frame, duration)
+            previous = frame
+            if chunk.full:
+                submit(chunk)
+                chunk = None
+                if len(in_flight) >= PARALLEL_WORKERS * 2:
+                    drain_one()
+        if chunk is not None:
+            submit(chunk)
+            chunk = None
+        while in_flight:
+            drain_one()
+    finally:
+        if chunk is not None:
+            chunk.release()
+        for pending in in_flight:
+            pending.future.cancel()
+            pending.release()
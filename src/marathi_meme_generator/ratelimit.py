@@ -0,0 +1,338 @@
+import os
+import time
+import asyncio
+import functools
+import threading
+
+# Searches the GIPHY key allows per period (beta keys get 100 an hour); 0 for no limit.
+# Every process keeps its own bucket, so split the quota between server processes.
+GIPHY_RATE_LIMIT = float(os.getenv("MEME_GIPHY_RATE_LIMIT", "100"))
+GIPHY_RATE_PERIOD = float(os.getenv("MEME_GIPHY_RATE_PERIOD", "3600"))
+# Consecutive 429s / timeouts that open the circuit, and how long it stays open
+# before a probe; the wait doubles after every failed probe, up to the maximum
+BREAKER_FAILURES = int(os.getenv("MEME_GIPHY_BREAKER_FAILURES", "3"))
+BREAKER_COOLDOWN = float(os.getenv("MEME_GIPHY_BREAKER_COOLDOWN", "30"))
+BREAKER_MAX_COOLDOWN = float(os.getenv("MEME_GIPHY_BREAKER_MAX_COOLDOWN", "600"))
+# Share of the quota that background refreshes leave for searches made for users
+GIPHY_REFRESH_RESERVE = float(os.getenv("MEME_GIPHY_REFRESH_RESERVE", "0.5"))
+# Seconds searches are collected before they are sent as one batch
+GIPHY_BATCH_WINDOW = float(os.getenv("MEME_GIPHY_BATCH_WINDOW", "0"))
+
+
+class GiphyUnavailable(Exception):
+    """Raised instead of (or after) a GIPHY search that cannot succeed now.
+
+    reason is 'circuit_open' or 'quota' when no call was made, and
+    'rate_limited', 'timeout' or 'error' when GIPHY was throttling or failing.
+    """
+
+    def __init__(self, reason, retry_after=None):
+        super().__init__(f"GIPHY unavailable: {reason}")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def retry_after_seconds(value):
+    """Parse a Retry-After header given in seconds, or return None."""
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """Tokens refill at rate per second up to capacity; each call takes one.
+
+    A rate of 0 means no limit.
+    """
+
+    def __init__(self, rate, capacity, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._tokens = capacity
+        self._updated = clock()
+
+    def _refill(self, now):
+        if now > self._updated:
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+
+    def available(self):
+        """Check for a token without taking it."""
+        if not self.rate:
+            return True
+        with self._lock:
+            self._refill(self._clock())
+            return self._tokens >= 1
+
+    def try_take(self):
+        """Take a token if there is one."""
+        if not self.rate:
+            return True
+        with self._lock:
+            self._refill(self._clock())
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    def drain(self, retry_after=None):
+        """Empty the bucket, as the server says the quota is used up.
+
+        With retry_after, refilling only starts once that many seconds passed.
+        """
+        if not self.rate:
+            return
+        with self._lock:
+            self._tokens = 0
+            self._updated = max(self._updated, self._clock() + (retry_after or 0))
+
+    def tokens(self):
+        """Return the tokens left, or None without a limit."""
+        if not self.rate:
+            return None
+        with self._lock:
+            self._refill(self._clock())
+            return self._tokens
+
+
+class CircuitBreaker:
+    """Stops calls after repeated failures and lets one probe through to test recovery.
+
+    Closed: calls go through. After failure_threshold consecutive failures
+    it opens: calls are refused for cooldown seconds. Then it is half open:
+    one probe call goes through, closing the circuit if it succeeds and
+    opening it again, for twice as long, if it fails.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=BREAKER_FAILURES, cooldown=BREAKER_COOLDOWN,
+                 max_cooldown=BREAKER_MAX_COOLDOWN, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._open_for = cooldown
+        self._open_until = 0.0
+        self._probing = False
+        self._stats = {'opened': 0, 'probes': 0, 'rejected': 0}
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state
+
+    def ready(self):
+        """Check whether a call would be allowed, without starting a probe."""
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.OPEN and self._clock() < self._open_until:
+                self._stats['rejected'] += 1
+                return False
+            if self._probing:
+                self._stats['rejected'] += 1
+                return False
+            return True
+
+    def allow(self):
+        """Return whether a call may go ahead; in half open state only one at a time."""
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.OPEN:
+                if self._clock() < self._open_until:
+                    self._stats['rejected'] += 1
+                    return False
+                self._state = self.HALF_OPEN
+            if self._probing:
+                self._stats['rejected'] += 1
+                return False
+            self._probing = True
+            self._stats['probes'] += 1
+            return True
+
+    def release(self):
+        """Forget an allowed call that was never made."""
+        with self._lock:
+            self._probing = False
+
+    def success(self):
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._open_for = self.cooldown
+            self._probing = False
+
+    def failure(self, retry_after=None):
+        with self._lock:
+            self._failures += 1
+            probe_failed = self._state == self.HALF_OPEN
+            self._probing = False
+            if not probe_failed and self._failures < self.failure_threshold:
+                return
+            if probe_failed:
+                self._open_for = min(self.max_cooldown, self._open_for * 2)
+            self._state = self.OPEN
+            self._open_until = self._clock() + max(self._open_for, retry_after or 0)
+            self._stats['opened'] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['state'] = self._state
+            stats['failures'] = self._failures
+            stats['open_for'] = max(0.0, self._open_until - self._clock()) if self._state == self.OPEN else 0.0
+        return stats
+
+
+class GiphyGate:
+    """A token bucket and a circuit breaker in front of every GIPHY search.
+
+    Searches that the quota or the circuit would refuse fail straight away
+    with GiphyUnavailable, without a round trip. Search functions raise
+    GiphyUnavailable themselves for 429s, timeouts and server errors, which
+    count as failures; any other outcome counts as a success.
+    """
+
+    def __init__(self, bucket, breaker):
+        self.bucket = bucket
+        self.breaker = breaker
+
+    def check(self):
+        """Fail fast when a search would be refused, without reserving anything."""
+        if not self.breaker.ready():
+            raise GiphyUnavailable('circuit_open')
+        if not self.bucket.available():
+            raise GiphyUnavailable('quota')
+
+    def acquire(self):
+        """Reserve a search: a token, and the probe slot when half open."""
+        if not self.breaker.allow():
+            raise GiphyUnavailable('circuit_open')
+        if not self.bucket.try_take():
+            self.breaker.release()
+            raise GiphyUnavailable('quota')
+
+    def has_spare(self, reserve=GIPHY_REFRESH_RESERVE):
+        """Check whether a search can go to background work, leaving reserve
+        (a share of the bucket) for searches made for users."""
+        if self.breaker.state != CircuitBreaker.CLOSED:
+            return False
+        tokens = self.bucket.tokens()
+        return tokens is None or tokens >= 1 + reserve * self.bucket.capacity
+
+    def record(self, error=None):
+        """Record how a reserved search went; error is the exception it raised, if any."""
+        if isinstance(error, GiphyUnavailable):
+            if error.reason == 'rate_limited':
+                self.bucket.drain(error.retry_after)
+            self.breaker.failure(error.retry_after)
+        else:
+            self.breaker.success()
+
+    def call(self, search, *args):
+        """Run search(*args) through the gate."""
+        self.acquire()
+        try:
+            result = search(*args)
+        except Exception as e:
+            self.record(e)
+            raise
+        self.record()
+        return result
+
+    def stats(self):
+        stats = self.breaker.stats()
+        stats['tokens'] = self.bucket.tokens()
+        return stats
+
+
+@functools.lru_cache(maxsize=None)
+def get_giphy_gate():
+    """Get the process-wide gate in front of GIPHY searches."""
+    rate = GIPHY_RATE_LIMIT / GIPHY_RATE_PERIOD if GIPHY_RATE_LIMIT > 0 else 0
+    return GiphyGate(TokenBucket(rate, max(1.0, GIPHY_RATE_LIMIT)), CircuitBreaker())
+
+
+class SearchBatcher:
+    """Sends the searches pending on an event loop through the gate in batches.
+
+    Searches started within window seconds of each other (by default, in
+    the same pass of the event loop, as the items of a /search/batch are)
+    are sent together: one call per distinct term, with the terms most
+    callers wait for first, so when the quota cannot pay for every term
+    the popular ones still get results and the rest fail fast.
+
+    Must be created and used from the event loop it serves.
+    """
+
+    def __init__(self, search, gate, window=GIPHY_BATCH_WINDOW):
+        self._search = search
+        self.gate = gate
+        self.window = window
+        self._pending = {}  # term -> Future
+        self._waiting = {}  # term -> callers
+        self._scheduled = False
+        self._running = set()
+        self._stats = {'batches': 0, 'searches': 0, 'merged': 0}
+
+    async def search(self, term):
+        """Return search(term), sharing the call with other callers for term."""
+        # Refused searches cost no more than this check
+        self.gate.check()
+        future = self._pending.get(term)
+        if future is None:
+            future = self._pending[term] = asyncio.get_running_loop().create_future()
+            # Nobody may be left to see a failure
+            future.add_done_callback(lambda done: done.cancelled() or done.exception())
+            self._waiting[term] = 0
+            if not self._scheduled:
+                self._scheduled = True
+                asyncio.get_running_loop().call_later(self.window, self._flush)
+        else:
+            self._stats['merged'] += 1
+        self._waiting[term] += 1
+        return await asyncio.shield(future)
+
+    def _flush(self):
+        pending, waiting = self._pending, self._waiting
+        self._pending, self._waiting, self._scheduled = {}, {}, False
+        self._stats['batches'] += 1
+        for term in sorted(pending, key=lambda term: -waiting[term]):
+            try:
+                self.gate.acquire()
+            except GiphyUnavailable as e:
+                pending[term].set_exception(e)
+                continue
+            self._stats['searches'] += 1
+            task = asyncio.ensure_future(self._run(term, pending[term]))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _run(self, term, future):
+        try:
+            result = await self._search(term)
+        except asyncio.CancelledError:
+            self.gate.breaker.release()
+            future.cancel()
+            raise
+        except Exception as e:
+            self.gate.record(e)
+            future.set_exception(e)
+            return
+        self.gate.record()
+        future.set_result(result)
+
+    def stats(self):
+        stats = dict(self._stats)
+        stats['pending'] = len(self._pending)
+        return stats
@@ -0,0 +1,234 @@
+import io
+import os
+import math
+from typing import NamedTuple
+
+from PIL import Image
+
+from marathi_meme_generator.caption import apply_caption, get_caption_sprite
+from marathi_meme_generator import fonts, parallel
+from marathi_meme_generator.blob_cache import get_blob_cache
+from marathi_meme_generator.encode import GifWriter, shared_palette, write_webp
+from marathi_meme_generator.metrics import span
+from marathi_meme_generator.template_library import get_template_library, is_template_url
+
+# Largest single frame rendered at full size, in pixels
+MAX_FRAME_PIXELS = int(os.getenv("MEME_MAX_FRAME_PIXELS", str(4096 * 4096)))
+# Most frames, and most pixels over all frames, of an animation
+MAX_FRAMES = int(os.getenv("MEME_MAX_FRAMES", "300"))
+MAX_ANIMATION_PIXELS = int(os.getenv("MEME_MAX_ANIMATION_PIXELS", str(150 * 1000 * 1000)))
+# "degrade" scales down / drops frames of oversized inputs, "reject" refuses them
+OVERSIZE_POLICY = os.getenv("MEME_OVERSIZE_POLICY", "degrade")
+# Largest source image decoded, in pixels, after any reduced-resolution decoding
+MAX_DECODE_PIXELS = int(os.getenv("MEME_MAX_DECODE_PIXELS", str(64 * 1000 * 1000)))
+# Size tier memes are rendered at unless a request asks for another
+DEFAULT_SIZE_TIER = os.getenv("MEME_SIZE_TIER", "large")
+# Browsers show frames shorter than this for 100 ms, so such timing is left alone
+MIN_FRAME_DURATION = 20
+# Resize in integer steps first, like Image.thumbnail does
+REDUCING_GAP = 2.0
+
+
+class RenderBudgetError(ValueError):
+    """Raised when an input exceeds the render budgets and may not be degraded."""
+
+
+class SizeTarget(NamedTuple):
+    """How large a meme is rendered; 0 means no limit."""
+    max_dimension: int  # longest side, in pixels
+    max_fps: int  # frames per second of animations
+
+    def cache_key(self):
+        return f"{self.max_dimension}/{self.max_fps}"
+
+SIZE_TIERS = {
+    'thumb': SizeTarget(320, 15),
+    'small': SizeTarget(480, 20),
+    'medium': SizeTarget(800, 25),
+    'large': SizeTarget(1280, 0),
+    'original': SizeTarget(0, 0),
+}
+
+def size_target(tier=None, max_dimension=None):
+    """Return the SizeTarget of a size tier, optionally capped at max_dimension."""
+    target = SIZE_TIERS.get(tier or DEFAULT_SIZE_TIER)
+    if target is None:
+        raise ValueError(f"Unknown size tier {tier!r}, expected one of {', '.join(SIZE_TIERS)}")
+    if max_dimension is not None:
+        if max_dimension < 1:
+            raise ValueError("max_dimension must be positive")
+        if not target.max_dimension or max_dimension < target.max_dimension:
+            target = target._replace(max_dimension=max_dimension)
+    return target
+
+
+def _output_size(image, max_dimension=0):
+    """Return the size to render image at, within max_dimension and the frame pixel budget."""
+    width, height = image.size
+    if max_dimension and max(width, height) > max_dimension:
+        scale = max_dimension / max(width, height)
+        width, height = max(1, round(width * scale)), max(1, round(height * scale))
+    pixels = width * height
+    if pixels <= MAX_FRAME_PIXELS:
+        return width, height
+    if OVERSIZE_POLICY == "reject":
+        raise RenderBudgetError(f"Image of {width}x{height} exceeds {MAX_FRAME_PIXELS} pixels")
+    scale = math.sqrt(MAX_FRAME_PIXELS / pixels)
+    return max(1, int(width * scale)), max(1, int(height * scale))
+
+def _frame_step(n_frames, size, duration=0, max_fps=0):
+    """Return k such that rendering every k-th frame stays within the animation budgets.
+
+    Animations faster than max_fps (judged by the duration of their first
+    frame, in milliseconds) are thinned out to about max_fps as well.
+    """
+    step = 1
+    if max_fps and MIN_FRAME_DURATION <= duration < 1000 / max_fps:
+        step = math.ceil(1000 / max_fps / duration)
+    allowed = min(MAX_FRAMES, MAX_ANIMATION_PIXELS // (size[0] * size[1]))
+    if math.ceil(n_frames / step) <= allowed:
+        return step
+    if OVERSIZE_POLICY == "reject" or allowed < 1:
+        raise RenderBudgetError(f"Animation of {n_frames} frames at {size[0]}x{size[1]} exceeds the render budget")
+    return max(step, math.ceil(n_frames / allowed))
+
+def _rgba(image, size):
+    if image.size != size and image.mode in ('RGB', 'RGBA', 'L'):
+        # Shrinking first leaves fewer pixels to convert
+        return image.resize(size, Image.Resampling.LANCZOS, reducing_gap=REDUCING_GAP).convert('RGBA')
+    frame = image.convert('RGBA')
+    if frame.size != size:
+        frame = frame.resize(size, Image.Resampling.LANCZOS, reducing_gap=REDUCING_GAP)
+    return frame
+
+def _decode(image, size):
+    """Decode image, at reduced resolution when the format allows it."""
+    if image.format == 'JPEG' and image.size != size:
+        # JPEG decodes at 1/2, 1/4 or 1/8 scale for a fraction of the work
+        image.draft(image.mode, size)
+    if image.width * image.height > MAX_DECODE_PIXELS:
+        raise RenderBudgetError(
+            f"Image of {image.width}x{image.height} exceeds the decode budget of {MAX_DECODE_PIXELS} pixels"
+        )
+    with span('decode'):
+        image.load()
+
+def iter_frames(image, size, step=1):
+    """Yield (RGBA frame, duration) for every step-th frame of image.
+
+    Frames are decoded one at a time, so memory use does not grow with the
+    length of the animation. Each frame is shown for its own duration plus
+    that of the frames skipped after it.
+    """
+    pending = None
+    for index in range(image.n_frames):
+        image.seek(index)
+        duration = image.info.get('duration', 100)
+        if index % step:
+            pending[1] += duration
+            continue
+        if pending is not None:
+            yield tuple(pending)
+        pending = [_rgba(image, size), duration]
+    if pending is not None:
+        yield tuple(pending)
+
+def iter_captioned_frames(image, size, sprite, step=1):
+    """Like iter_frames, with the caption applied to every frame."""
+    for frame, duration in iter_frames(image, size, step):
+        yield apply_caption(frame, sprite), duration
+
+def _has_transparency(image):
+    return 'transparency' in image.info or image.mode in ('RGBA', 'LA', 'PA')
+
+def _encode_animation(image, text, script, size, sprite, animated_format, max_fps=0):
+    step = _frame_step(image.n_frames, size, image.info.get('duration', 0), max_fps)
+    n_frames = math.ceil(image.n_frames / step)
+    img_byte_arr = io.BytesIO()
+    if animated_format == 'webp':
+        frames = iter_captioned_frames(image, size, sprite, step)
+        write_webp(frames, img_byte_arr, size, n_frames, loop=0)
+        img_byte_arr.seek(0)
+        return img_byte_arr, 'image/webp'
+
+    transparent = _has_transparency(image)
+    paletted_source = image.mode == 'P' and size == image.size
+    source_palette = image.getpalette()
+    frames = iter_frames(image, size, step)
+    first, duration = next(frames)
+    captioned = apply_caption(first.copy(), sprite)
+
+    palette = None
+    if paletted_source:
+        # Frames at their original size can keep the source colours as they are
+        palette = shared_palette(captioned, source_palette, sprite.top)
+    writer = GifWriter(img_byte_arr, 0, palette, sprite.top, transparent)
+    writer.add(captioned, duration)
+    if parallel.use_parallel(n_frames, size):
+        parallel.add_frames(writer, frames, first, text, script)
+    else:
+        for frame, duration in frames:
+            writer.add(apply_caption(frame, sprite), duration)
+    writer.close()
+    img_byte_arr.seek(0)
+    return img_byte_arr, 'image/gif'
+
+
+def render_meme(image, text, script=None, animated_format='gif', target=None):
+    """Add the caption to an opened image and encode the result.
+
+    Animations are encoded as animated_format ('gif' or 'webp'), still
+    images as PNG. target (a SizeTarget, the default tier when None) bounds
+    the output size, and the caption is laid out at that final size.
+    Returns the encoded bytes and their media type.
+    """
+    target = target or size_target()
+    size = _output_size(image, target.max_dimension)
+    # Later frames of an animation are decoded as they are encoded
+    _decode(image, size)
+    # Every frame has the same size and caption, so rasterize it only once
+    sprite = get_caption_sprite(text, size[0], size[1], script)
+
+    # Check if image is animated GIF
+    if getattr(image, "is_animated", False):
+        with span('encode'):
+            return _encode_animation(image, text, script, size, sprite, animated_format, target.max_fps)
+
+    with span('draw'):
+        image = apply_caption(_rgba(image, size), sprite)
+
+    img_byte_arr = io.BytesIO()
+    with span('encode'):
+        image.convert('RGB').save(img_byte_arr, format='PNG')
+    img_byte_arr.seek(0)
+    return img_byte_arr, 'image/png'
+
+def render_cached_image(record, text, script=None, animated_format='gif', target=None):
+    """Render a meme from a source image in the blob cache.
+
+    Takes the blob cache record rather than the image so it can run in a
+    worker process. Returns the encoded bytes and their media type.
+    """
+    image = Image.open(get_blob_cache().open(record))
+    image_bytes, media_type = render_meme(image, text, script, animated_format, target)
+    return image_bytes.getvalue(), media_type
+
+def render_template(url, text, script=None, animated_format='gif', target=None):
+    """Render a meme from a template:// URL of the template library.
+
+    The template's frames are already decoded, so nothing is read from disk
+    or the network. Returns the encoded bytes and their media type.
+    """
+    image_bytes, media_type = render_meme(get_template_library().open(url), text, script, animated_format, target)
+    return image_bytes.getvalue(), media_type
+
+def render_source(source, text, script=None, animated_format='gif', target=None):
+    """Render a meme from a blob cache record or a template:// URL."""
+    if isinstance(source, str) and is_template_url(source):
+        return render_template(source, text, script, animated_format, target)
+    return render_cached_image(source, text, script, animated_format, target)
+
+def init_worker():
+    """Load fonts and decode the template library once per render worker."""
+    fonts.load_fonts()
+    get_template_library()
@@ -0,0 +1,136 @@
+import os
+import hashlib
+import functools
+import threading
+from collections import OrderedDict
+from typing import NamedTuple
+
+from marathi_meme_generator.blob_cache import BlobCache
+
+# Bytes of finished memes kept in memory, and on disk once they spill over
+RESULT_CACHE_MAX_BYTES = int(os.getenv("MEME_RESULT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+RESULT_CACHE_DIR = os.getenv(
+    "MEME_RESULT_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "marathi-meme-generator", "results"),
+)
+RESULT_CACHE_DISK_MAX_BYTES = int(os.getenv("MEME_RESULT_CACHE_DISK_MAX_BYTES", str(1024 * 1024 * 1024)))
+
+# Rendered memes never change, so spilled copies never need revalidation
+_SPILL_HEADERS_MAX_AGE = 'max-age=315360000'
+
+
+class RenderedMeme(NamedTuple):
+    """Finished meme bytes with their media type and strong ETag."""
+    content: bytes
+    media_type: str
+    etag: str
+
+
+def result_key(source_url, text, language, animated_format='gif', size=''):
+    """Return the cache key of a (source image, caption, language, output format, size) combination."""
+    parts = (source_url, text, language, animated_format, size)
+    return hashlib.sha256('\0'.join(parts).encode('utf-8')).hexdigest()
+
+def make_etag(content):
+    """Return a strong ETag for content."""
+    return '"' + hashlib.sha256(content).hexdigest()[:32] + '"'
+
+
+class ResultCache:
+    """Two-tier cache of rendered memes: an in-memory LRU bounded by bytes
+    that spills evicted entries to a content-addressed disk cache."""
+
+    def __init__(self, max_bytes=RESULT_CACHE_MAX_BYTES, spill_dir=RESULT_CACHE_DIR,
+                 spill_max_bytes=RESULT_CACHE_DISK_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._size = 0
+        self._spill = BlobCache(spill_dir, spill_max_bytes) if spill_dir else None
+        self._stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'spilled': 0}
+
+    def peek(self, key):
+        """Return the RenderedMeme kept in memory under key, or None; never reads the disk."""
+        with self._lock:
+            meme = self._entries.get(key)
+            if meme is not None:
+                self._entries.move_to_end(key)
+                self._stats['memory_hits'] += 1
+            return meme
+
+    def get(self, key):
+        """Return the RenderedMeme stored under key, or None.
+
+        May read the disk and spill other entries to it; async callers
+        run it in a thread after a peek().
+        """
+        with self._lock:
+            meme = self._entries.get(key)
+            if meme is not None:
+                self._entries.move_to_end(key)
+                self._stats['memory_hits'] += 1
+                return meme
+
+        meme = self._read_spilled(key)
+        with self._lock:
+            self._stats['disk_hits' if meme else 'misses'] += 1
+        if meme is not None:
+            self.put(key, meme.content, meme.media_type)
+        return meme
+
+    def put(self, key, content, media_type):
+        """Store rendered bytes under key and return the RenderedMeme."""
+        meme = RenderedMeme(content, media_type, make_etag(content))
+        evicted = []
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= len(old.content)
+            self._entries[key] = meme
+            self._size += len(content)
+            while self._size > self.max_bytes and self._entries:
+                evicted_key, evicted_meme = self._entries.popitem(last=False)
+                self._size -= len(evicted_meme.content)
+                evicted.append((evicted_key, evicted_meme))
+
+        for evicted_key, evicted_meme in evicted:
+            self._write_spilled(evicted_key, evicted_meme)
+        return meme
+
+    def stats(self):
+        """Return hit/miss counters and memory usage."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+            stats['bytes'] = self._size
+        return stats
+
+    def _read_spilled(self, key):
+        if self._spill is None:
+            return None
+        record = self._spill.lookup(key)
+        if record is None:
+            return None
+        try:
+            with self._spill.open(record) as buffer:
+                content = bytes(buffer[:])
+        except FileNotFoundError:
+            return None
+        return RenderedMeme(content, record['content_type'], record['etag'])
+
+    def _write_spilled(self, key, meme):
+        if self._spill is None:
+            return
+        self._spill.store(key, meme.content, {
+            'Content-Type': meme.media_type,
+            'ETag': meme.etag,
+            'Cache-Control': _SPILL_HEADERS_MAX_AGE,
+        })
+        with self._lock:
+            self._stats['spilled'] += 1
+
+
+@functools.lru_cache(maxsize=None)
+def get_result_cache():
+    """Get the process-wide rendered meme cache."""
+    return ResultCache()
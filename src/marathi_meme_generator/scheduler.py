@@ -0,0 +1,169 @@
+import math
+import time
+import asyncio
+import functools
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# Number of recent requests wait and render times are reported over
+STATS_WINDOW = 1000
+
+
+class Overloaded(Exception):
+    """Raised when the render queue is full; retry_after is a hint in seconds."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Render queue is full, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a render cannot finish before its deadline."""
+
+
+class WorkerCrashed(Exception):
+    """Raised when a worker process died during a render; retry_after is a hint in seconds."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"A render worker crashed, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+
+def _percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class RenderScheduler:
+    """Runs render jobs in a fixed pool of worker processes.
+
+    At most `workers` jobs run at once and at most `max_queue` more wait for
+    a worker; further jobs are refused straight away with Overloaded. Jobs
+    whose deadline (a time.monotonic() value) passes while they wait are
+    dropped before they reach a worker. Workers live as long as the
+    scheduler, so whatever initializer loads (fonts, caches) stays warm. If
+    a worker dies the pool is replaced with a fresh one and the jobs it took
+    down fail with WorkerCrashed.
+
+    Must be created and used from the event loop it serves.
+    """
+
+    def __init__(self, workers, max_queue, initializer=None):
+        self.workers = workers
+        self.max_queue = max_queue
+        self._initializer = initializer
+        self._executor = self._new_executor()
+        self._slots = asyncio.Semaphore(workers)
+        self._queued = 0
+        self._running = 0
+        self._waits = deque(maxlen=STATS_WINDOW)
+        self._durations = deque(maxlen=STATS_WINDOW)
+        self._stats = {
+            'submitted': 0,
+            'completed': 0,
+            'failed': 0,
+            'rejected': 0,
+            'expired': 0,
+            'restarts': 0,
+        }
+
+    def _new_executor(self):
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=self._initializer,
+        )
+
+    def _restart(self, executor):
+        """Replace a broken executor, once however many of its jobs report it."""
+        if self._executor is executor:
+            self._stats['restarts'] += 1
+            executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = self._new_executor()
+        return WorkerCrashed(self.retry_after())
+
+    async def run(self, fn, *args, deadline=None):
+        """Run fn(*args) in a worker process and return its result."""
+        if self._queued >= self.max_queue:
+            self._stats['rejected'] += 1
+            raise Overloaded(self.retry_after())
+        self._stats['submitted'] += 1
+
+        enqueued = time.monotonic()
+        self._queued += 1
+        try:
+            timeout = None if deadline is None else max(0, deadline - enqueued)
+            await asyncio.wait_for(self._slots.acquire(), timeout)
+        except asyncio.TimeoutError:
+            self._stats['expired'] += 1
+            raise DeadlineExceeded("Timed out waiting for a render worker")
+        finally:
+            self._queued -= 1
+
+        started = time.monotonic()
+        self._waits.append(started - enqueued)
+        if deadline is not None and started >= deadline:
+            self._slots.release()
+            self._stats['expired'] += 1
+            raise DeadlineExceeded("Deadline passed while waiting for a render worker")
+
+        executor = self._executor
+        try:
+            future = asyncio.get_running_loop().run_in_executor(
+                executor, functools.partial(fn, *args)
+            )
+        except BrokenProcessPool:
+            self._slots.release()
+            self._stats['failed'] += 1
+            raise self._restart(executor)
+        self._running += 1
+        # The worker stays busy until the job ends, even if we stop waiting for it
+        future.add_done_callback(functools.partial(self._finished, started))
+        try:
+            timeout = None if deadline is None else deadline - started
+            return await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            self._stats['expired'] += 1
+            raise DeadlineExceeded("Render did not finish before the deadline")
+        except BrokenProcessPool:
+            raise self._restart(executor)
+
+    def _finished(self, started, future):
+        self._running -= 1
+        self._durations.append(time.monotonic() - started)
+        self._slots.release()
+        if future.cancelled() or future.exception() is not None:
+            self._stats['failed'] += 1
+        else:
+            self._stats['completed'] += 1
+
+    def retry_after(self):
+        """Estimate in whole seconds when a worker is likely to be free again."""
+        render_time = sum(self._durations) / len(self._durations) if self._durations else 1.0
+        backlog = (self._queued + self._running) / self.workers
+        return max(1, math.ceil(backlog * render_time))
+
+    def stats(self):
+        """Return queue depth, counters and recent wait / render times in milliseconds."""
+        waits = list(self._waits)
+        durations = list(self._durations)
+        stats = dict(self._stats)
+        stats.update({
+            'workers': self.workers,
+            'max_queue': self.max_queue,
+            'queued': self._queued,
+            'running': self._running,
+            'wait_ms_avg': 1000 * sum(waits) / len(waits) if waits else 0.0,
+            'wait_ms_p95': 1000 * _percentile(waits, 0.95),
+            'wait_ms_max': 1000 * max(waits, default=0.0),
+            'render_ms_avg': 1000 * sum(durations) / len(durations) if durations else 0.0,
+            'render_ms_p95': 1000 * _percentile(durations, 0.95),
+        })
+        return stats
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
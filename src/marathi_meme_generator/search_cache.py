@@ -0,0 +1,153 @@
+import time
+import logging
+import threading
+
+
+class SearchCache:
+    """TTL cache of search results with stale-while-revalidate refreshes.
+
+    fetch(term, rating) returns the list of result URLs for a search. Fresh
+    entries are served as is; entries past ttl but within stale_ttl are
+    served immediately while a background thread refreshes them.
+    """
+
+    def __init__(self, fetch, ttl=3600, stale_ttl=86400):
+        self._fetch = fetch
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._lock = threading.Lock()
+        self._entries = {}  # (term, rating) -> (urls, fetched_at)
+        self._refreshing = set()
+        self._refresher = None
+        self._stats = {
+            'hits': 0,
+            'stale_hits': 0,
+            'misses': 0,
+            'pool_hits': 0,
+            'pool_misses': 0,
+            'refreshes': 0,
+            'deferred': 0,
+            'errors': 0,
+        }
+
+    def get(self, term, rating='g'):
+        """Return the result URLs for term, fetching only on a cold miss."""
+        key = (term, rating)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and now - entry[1] < self.ttl:
+                self._stats['hits'] += 1
+                return entry[0]
+            if entry and now - entry[1] < self.stale_ttl:
+                self._stats['stale_hits'] += 1
+                stale = entry[0]
+            else:
+                self._stats['misses'] += 1
+                stale = None
+
+        if stale is not None:
+            self._refresh_in_background(key)
+            return stale
+        return self.refresh(term, rating, raise_errors=True)
+
+    def refresh(self, term, rating='g', raise_errors=False):
+        """Fetch term again and store the result; keeps the old entry on errors."""
+        key = (term, rating)
+        try:
+            urls = list(self._fetch(term, rating))
+        except Exception as e:
+            with self._lock:
+                self._stats['errors'] += 1
+            if raise_errors:
+                raise
+            logging.warning(f"Failed to refresh search '{term}': {str(e)}")
+            return self.peek(term, rating)
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+        with self._lock:
+            self._entries[key] = (urls, time.monotonic())
+            self._stats['refreshes'] += 1
+        return urls
+
+    def peek(self, term, rating='g'):
+        """Return cached URLs for term (fresh or stale) without fetching."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get((term, rating))
+        if entry and now - entry[1] < self.stale_ttl:
+            return entry[0]
+        return []
+
+    def pool(self, terms, rating='g'):
+        """Return every cached URL for terms, refreshing stale entries in the background."""
+        urls = []
+        stale = []
+        now = time.monotonic()
+        with self._lock:
+            for term in terms:
+                entry = self._entries.get((term, rating))
+                if not entry or now - entry[1] >= self.stale_ttl:
+                    continue
+                urls.extend(entry[0])
+                if now - entry[1] >= self.ttl:
+                    stale.append((term, rating))
+            self._stats['pool_hits' if urls else 'pool_misses'] += 1
+
+        for key in stale:
+            self._refresh_in_background(key)
+        return urls
+
+    def start_refresher(self, keys, interval=60, batch_size=5, allow=None):
+        """Keep (term, rating) keys warm from a daemon thread.
+
+        Every interval seconds, up to batch_size missing or expired keys are
+        fetched, so warming the pool does not burst through the rate limit.
+        allow, if given, is asked before every fetch; when it says no, the
+        rest of the cycle waits for the next one.
+        """
+        with self._lock:
+            if self._refresher is not None:
+                return
+            self._refresher = threading.Thread(
+                target=self._refresh_loop, args=(list(keys), interval, batch_size, allow),
+                name="search-cache-refresher", daemon=True
+            )
+        self._refresher.start()
+
+    def stats(self):
+        """Return hit/miss counters and the share of lookups served from memory."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+        lookups = stats['hits'] + stats['stale_hits'] + stats['misses']
+        stats['hit_ratio'] = (stats['hits'] + stats['stale_hits']) / lookups if lookups else 0.0
+        pool_lookups = stats['pool_hits'] + stats['pool_misses']
+        stats['pool_hit_ratio'] = stats['pool_hits'] / pool_lookups if pool_lookups else 0.0
+        return stats
+
+    def _refresh_in_background(self, key):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+        threading.Thread(target=self.refresh, args=key, daemon=True).start()
+
+    def _refresh_loop(self, keys, interval, batch_size, allow):
+        while True:
+            now = time.monotonic()
+            with self._lock:
+                due = [
+                    key for key in keys
+                    if key not in self._refreshing
+                    and (key not in self._entries or now - self._entries[key][1] >= self.ttl)
+                ]
+            for term, rating in due[:batch_size]:
+                if allow is not None and not allow():
+                    with self._lock:
+                        self._stats['deferred'] += 1
+                    break
+                self.refresh(term, rating)
+            time.sleep(interval)
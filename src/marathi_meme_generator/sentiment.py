@@ -0,0 +1,225 @@
+import os
+import re
+import sys
+import json
+import time
+import logging
+import argparse
+import functools
+import threading
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+
+from marathi_meme_generator import lexicon
+
+# Number of normalized captions whose label is remembered
+SENTIMENT_CACHE_SIZE = int(os.getenv("MEME_SENTIMENT_CACHE_SIZE", "100000"))
+
+MARATHI_PATTERN = re.compile(r'[\u0900-\u097F]')
+
+# VADER's lexicon ships with the package, so it is never looked up elsewhere or downloaded
+NLTK_DATA_DIR = Path(__file__).parent / 'nltk_data'
+VADER_LEXICON = 'sentiment/vader_lexicon/vader_lexicon.txt'
+
+# Load emotion data from JSON
+def load_emotions():
+    """Load emotion data from JSON file."""
+    try:
+        json_path = Path(__file__).parent / 'emotions.json'
+        with open(json_path, 'r', encoding='utf-8') as f:
+            emotions_data = json.load(f)
+        return emotions_data
+    except Exception as e:
+        logging.error(f"Error loading emotions.json: {str(e)}")
+        return {}
+
+@functools.lru_cache(maxsize=None)
+def get_emotion_lexicon():
+    """Get the Marathi word lists and phrases compiled into one automaton, on first use."""
+    emotions_data = load_emotions()
+    marathi_emotions = {emotion: set(words) for emotion, words in emotions_data.items() if emotion != 'phrases'}
+    return lexicon.compile_lexicon(marathi_emotions, emotions_data.get('phrases', {}))
+
+_cache_lock = threading.Lock()
+_result_cache = OrderedDict()
+_stats = {
+    'texts': 0,
+    'unique': 0,
+    'cache_hits': 0,
+    'rule_decided': 0,
+    'vader_scored': 0,
+    'seconds': 0.0,
+}
+
+
+@functools.lru_cache(maxsize=None)
+def get_analyzer():
+    """Get the shared VADER analyzer, creating it on first use."""
+    # Importing NLTK alone takes a good part of a second, so only pay for it here
+    import nltk
+    from nltk.sentiment import SentimentIntensityAnalyzer
+    if str(NLTK_DATA_DIR) not in nltk.data.path:
+        nltk.data.path.insert(0, str(NLTK_DATA_DIR))
+    return SentimentIntensityAnalyzer(lexicon_file=VADER_LEXICON)
+
+def warm_up():
+    """Load the emotion lexicon and the VADER analyzer ahead of the first caption."""
+    get_emotion_lexicon()
+    get_analyzer()
+
+def is_marathi(text):
+    """Check if text contains Marathi Unicode characters."""
+    return bool(MARATHI_PATTERN.search(text))
+
+def is_marathi_transcript(text):
+    """Check if text might be Marathi written in English."""
+    words = set(text.lower().split())
+    marathi_word_count = len(words.intersection(get_emotion_lexicon().roast_words))
+    return marathi_word_count / len(words) > 0.2 if words else False
+
+def detect_emotion(text):
+    """check the emotion from Marathi text."""
+    # Single pass over the text with the precompiled lexicon
+    return lexicon.detect_emotion(get_emotion_lexicon(), text)
+
+def analyze_sentiment(text):
+    """Analyze sentiment of the text using NLTK's VADER and custom Marathi word lists."""
+    # First check for Marathi emotion using detect_emotion
+    emotion = detect_emotion(text.lower())
+    if emotion != 'neutral':
+        return emotion
+
+    # If no Marathi emotion detected, use NLTK for English
+    return vader_sentiment(text)
+
+def vader_sentiment(text):
+    """Classify text as happy, sad or neutral with VADER alone."""
+    try:
+        scores = get_analyzer().polarity_scores(text)
+        compound_score = scores['compound']
+
+        if compound_score >= 0.05:
+            return 'happy'
+        elif compound_score <= -0.05:
+            return 'sad'
+        else:
+            return 'neutral'
+    except Exception as e:
+        logging.error(f"Error in sentiment analysis: {str(e)}")
+        return 'neutral'
+
+def normalize_text(text):
+    """Collapse the ways of writing the same caption: Unicode form and spacing.
+
+    Case is kept, as VADER reads capitals as emphasis. Layout splits
+    captions on whitespace, so this never changes the meme.
+    """
+    return ' '.join(unicodedata.normalize('NFC', text).split())
+
+def analyze_sentiment_batch(texts):
+    """Analyze many captions at once, returning one label per input text.
+
+    Captions differing only in Unicode form or whitespace share one label
+    and one cache entry; labels are the ones analyze_sentiment gives. VADER
+    only runs for captions the Marathi rules leave neutral.
+    """
+    start = time.perf_counter()
+    keys = [normalize_text(text) for text in texts]
+    originals = dict(zip(reversed(keys), reversed(texts)))  # key -> its first text
+    labels = {}
+    cache_hits = rule_decided = vader_scored = 0
+
+    for key in dict.fromkeys(keys):
+        with _cache_lock:
+            label = _result_cache.get(key)
+            if label is not None:
+                _result_cache.move_to_end(key)
+        if label is not None:
+            cache_hits += 1
+            labels[key] = label
+            continue
+
+        label = detect_emotion(key.lower())
+        if label != 'neutral':
+            rule_decided += 1
+        else:
+            vader_scored += 1
+            label = vader_sentiment(originals[key])
+        labels[key] = label
+
+        with _cache_lock:
+            _result_cache[key] = label
+            if len(_result_cache) > SENTIMENT_CACHE_SIZE:
+                _result_cache.popitem(last=False)
+
+    with _cache_lock:
+        _stats['texts'] += len(keys)
+        _stats['unique'] += len(labels)
+        _stats['cache_hits'] += cache_hits
+        _stats['rule_decided'] += rule_decided
+        _stats['vader_scored'] += vader_scored
+        _stats['seconds'] += time.perf_counter() - start
+
+    return [labels[key] for key in keys]
+
+def sentiment_stats():
+    """Return counters and throughput of analyze_sentiment_batch."""
+    with _cache_lock:
+        stats = dict(_stats)
+        stats['cached'] = len(_result_cache)
+    stats['texts_per_second'] = stats['texts'] / stats['seconds'] if stats['seconds'] else 0.0
+    return stats
+
+def read_captions(lines, field):
+    """Yield the records of a JSONL file of captions; bare values become {field: value}."""
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        record = json.loads(line)
+        if not isinstance(record, dict):
+            record = {field: record}
+        yield record
+
+def _write_labelled(records, field, sink):
+    labels = analyze_sentiment_batch([str(record.get(field, '')) for record in records])
+    for record, label in zip(records, labels):
+        record['emotion'] = label
+        sink.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+def main(argv=None):
+    """Label every caption of a JSONL file with its emotion."""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('input', help="JSONL file of captions, '-' for stdin")
+    parser.add_argument('-o', '--output', default='-', help="JSONL output, '-' for stdout")
+    parser.add_argument('--field', default='text', help="caption field of each record")
+    parser.add_argument('--batch-size', type=int, default=10000)
+    args = parser.parse_args(argv)
+
+    source = sys.stdin if args.input == '-' else open(args.input, 'r', encoding='utf-8')
+    sink = sys.stdout if args.output == '-' else open(args.output, 'w', encoding='utf-8')
+    try:
+        batch = []
+        for record in read_captions(source, args.field):
+            batch.append(record)
+            if len(batch) >= args.batch_size:
+                _write_labelled(batch, args.field, sink)
+                batch = []
+        if batch:
+            _write_labelled(batch, args.field, sink)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if sink is not sys.stdout:
+            sink.close()
+
+    stats = sentiment_stats()
+    print(
+        f"{stats['texts']} captions ({stats['unique']} unique, {stats['cache_hits']} cached, "
+        f"{stats['vader_scored']} scored by VADER) at {stats['texts_per_second']:.0f} captions/s",
+        file=sys.stderr
+    )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,332 @@
+"""Local library of meme templates, served without any network access.
+
+Usage: python -m marathi_meme_generator.template_library [--dir DIR] [--fetch] [--predecode]
+
+The library is a directory with one subdirectory of images per emotion
+(happy/, sad/, neutral/, ...) and a manifest.json describing every image:
+its emotion, dimensions, frame count and frame durations. Running this
+module writes the manifest for the images found; --fetch first downloads
+the fallback memes of meme_search_terms.json into it, and --predecode
+also writes every template as raw frames that the library memory-maps
+instead of decoding.
+
+Templates are decoded once per process into in-memory frames and named
+by template://<emotion>/<name> URLs, which the rest of the app accepts
+wherever it takes a source image URL.
+"""
+import os
+import re
+import sys
+import json
+import mmap
+import random
+import hashlib
+import logging
+import argparse
+import functools
+from pathlib import Path
+from urllib.parse import urlparse
+
+from PIL import Image, ImageChops
+
+# Where the template library lives
+TEMPLATE_DIR = os.getenv(
+    "MEME_TEMPLATE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "marathi-meme-generator", "templates"),
+)
+# Map the pre-decoded frames written by --predecode instead of decoding the images
+TEMPLATE_MMAP = os.getenv("MEME_TEMPLATE_MMAP", "false").lower() in ("1", "true", "yes")
+# Never call GIPHY or download images; memes come from the template library
+OFFLINE_MODE = os.getenv("MEME_OFFLINE", "false").lower() in ("1", "true", "yes")
+
+TEMPLATE_SCHEME = 'template://'
+MANIFEST = 'manifest.json'
+PREDECODED_SUFFIX = '.frames'
+IMAGE_SUFFIXES = ('.gif', '.png', '.jpg', '.jpeg', '.webp')
+
+
+def is_template_url(url):
+    return bool(url) and url.startswith(TEMPLATE_SCHEME)
+
+def template_url(template_id):
+    return TEMPLATE_SCHEME + template_id
+
+
+class DecodedImage(Image.Image):
+    """An image whose frames were decoded ahead of time.
+
+    Seeking switches between the decoded frames instead of decoding the
+    file again, so it can be passed to render_meme like an opened image.
+    The frames are shared; every caller gets its own DecodedImage.
+    """
+
+    def __init__(self, frames, format=None):
+        super().__init__()
+        self._frames = frames
+        self.format = format
+        self.n_frames = len(frames)
+        self.is_animated = self.n_frames > 1
+        self._frame = -1
+        self.seek(0)
+
+    def tell(self):
+        return self._frame
+
+    def seek(self, frame):
+        image, info = self._frames[frame]
+        self.im = image.im
+        self._mode = image.mode
+        self._size = image.size
+        self.palette = image.palette
+        self.info = dict(info)
+        # Anything drawing on this image copies the frame first
+        self.readonly = 1
+        self._frame = frame
+
+
+def _compact(frame):
+    """Return frame as a paletted image when that loses nothing, else as it is.
+
+    GIF frames after the first decode to RGB; most of them still fit in 256
+    colours, and a third of the memory.
+    """
+    if frame.mode != 'RGB' or frame.getcolors(256) is None:
+        return frame
+    paletted = frame.quantize(256, dither=Image.Dither.NONE)
+    if ImageChops.difference(paletted.convert('RGB'), frame).getbbox() is not None:
+        return frame
+    return paletted
+
+def _frame_info(image):
+    info = {'duration': image.info.get('duration', 100)}
+    for name in ('transparency', 'background', 'loop'):
+        if name in image.info:
+            info[name] = image.info[name]
+    return info
+
+def decode_frames(path):
+    """Decode every frame of an image file into a list of (image, info)."""
+    frames = []
+    with Image.open(path) as image:
+        source_format = image.format
+        for index in range(getattr(image, 'n_frames', 1)):
+            image.seek(index)
+            image.load()
+            frame = _compact(image.copy())
+            # Realize the palette now, so sharing the frame never writes to it
+            frame.load()
+            frames.append((frame, _frame_info(image)))
+    return frames, source_format
+
+def _predecoded_mode(frames):
+    # Four bytes a pixel, which Pillow can map in place; three would be copied
+    return 'RGBA' if any(
+        'transparency' in info or frame.mode in ('RGBA', 'LA', 'PA') for frame, info in frames
+    ) else 'RGBX'
+
+def map_frames(path, entry):
+    """Map a file written by write_predecoded as a list of (image, info)."""
+    mode = entry['mode']
+    size = (entry['width'], entry['height'])
+    frame_bytes = size[0] * size[1] * len(mode)
+    with open(path, 'rb') as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if len(buffer) != frame_bytes * entry['frames']:
+        buffer.close()
+        raise ValueError(f"{path} does not hold {entry['frames']} frames of {size[0]}x{size[1]} {mode}")
+    view = memoryview(buffer)
+    return [
+        (
+            Image.frombuffer(mode, size, view[index * frame_bytes:(index + 1) * frame_bytes], 'raw', mode, 0, 1),
+            {'duration': duration, 'loop': 0},
+        )
+        for index, duration in enumerate(entry['durations'])
+    ]
+
+def write_predecoded(path, frames):
+    """Write frames as raw pixels, one after another; returns their mode."""
+    mode = _predecoded_mode(frames)
+    with open(path, 'wb') as f:
+        for frame, _ in frames:
+            f.write(frame.convert(mode).tobytes())
+    return mode
+
+
+class TemplateLibrary:
+    """Emotion-indexed templates, decoded once and kept in memory.
+
+    Images shared by several emotions (or listed twice) are decoded once,
+    by content digest. With use_mmap, templates that have pre-decoded
+    frames are mapped rather than decoded, so every process reading them
+    shares the same pages.
+    """
+
+    def __init__(self, root=TEMPLATE_DIR, use_mmap=TEMPLATE_MMAP):
+        self.root = Path(root)
+        self.templates = {}  # id -> manifest entry
+        self.by_emotion = {}  # emotion -> [id]
+        self._frames = {}  # id -> [(image, info)]
+        self._formats = {}
+
+        try:
+            with open(self.root / MANIFEST, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            logging.info(f"No template library at {self.root}")
+            return
+        except (OSError, ValueError) as e:
+            logging.error(f"Error loading template manifest from {self.root}: {str(e)}")
+            return
+
+        decoded = {}
+        for entry in manifest.get('templates', []):
+            try:
+                if entry['digest'] not in decoded:
+                    decoded[entry['digest']] = self._load(entry, use_mmap)
+            except Exception as e:
+                logging.warning(f"Skipping template {entry.get('id')}: {str(e)}")
+                continue
+            self.templates[entry['id']] = entry
+            self.by_emotion.setdefault(entry['emotion'], []).append(entry['id'])
+            self._frames[entry['id']], self._formats[entry['id']] = decoded[entry['digest']]
+        logging.info(f"Loaded {len(self.templates)} templates from {self.root}")
+
+    def _load(self, entry, use_mmap):
+        if use_mmap and entry.get('predecoded'):
+            try:
+                return map_frames(self.root / entry['predecoded'], entry), None
+            except (OSError, ValueError) as e:
+                logging.warning(f"Decoding template {entry['id']} instead of mapping it: {str(e)}")
+        return decode_frames(self.root / entry['file'])
+
+    def __len__(self):
+        return len(self.templates)
+
+    def __contains__(self, url):
+        return is_template_url(url) and url[len(TEMPLATE_SCHEME):] in self.templates
+
+    def pick(self, emotion=None, rng=random):
+        """Return the URL of a random template for emotion, or None when there is none.
+
+        Emotions without templates of their own fall back to neutral ones,
+        then to any template.
+        """
+        ids = self.by_emotion.get(emotion) or self.by_emotion.get('neutral') or sorted(self.templates)
+        if not ids:
+            return None
+        return template_url(rng.choice(ids))
+
+    def open(self, url):
+        """Return a template as an image ready for render_meme, without decoding anything."""
+        if url not in self:
+            raise KeyError(f"Unknown template {url}")
+        template_id = url[len(TEMPLATE_SCHEME):]
+        return DecodedImage(self._frames[template_id], self._formats[template_id])
+
+    def stats(self):
+        """Report the templates per emotion and the memory their frames hold."""
+        decoded = mapped = n_frames = 0
+        for frames in {id(frames): frames for frames in self._frames.values()}.values():
+            for frame, _ in frames:
+                size = frame.width * frame.height * len(frame.getbands())
+                if frame.readonly:
+                    mapped += size
+                else:
+                    decoded += size
+                n_frames += 1
+        return {
+            'templates': len(self.templates),
+            'emotions': {emotion: len(ids) for emotion, ids in self.by_emotion.items()},
+            'frames': n_frames,
+            'decoded_bytes': decoded,
+            'mapped_bytes': mapped,
+        }
+
+
+@functools.lru_cache(maxsize=None)
+def get_template_library():
+    """Get the process-wide template library, loading it on first use."""
+    return TemplateLibrary()
+
+
+def _asset_name(url):
+    # media/<id>/giphy.gif -> <id>-giphy.gif
+    parts = [part for part in urlparse(url).path.split('/') if part][-2:]
+    return re.sub(r'[^\w.-]', '_', '-'.join(parts)).lstrip('.') or '_'
+
+def fetch_fallback_memes(root, session=None):
+    """Download the fallback memes of meme_search_terms.json into root/<emotion>/."""
+    import requests
+    from marathi_meme_generator.giphy import load_meme_config
+
+    session = session or requests.Session()
+    fallback_memes = load_meme_config().get('fallback_memes', {})
+    for emotion, urls in fallback_memes.items():
+        for url in urls:
+            path = root / emotion / _asset_name(url)
+            if path.exists():
+                continue
+            try:
+                response = session.get(url, timeout=30)
+                response.raise_for_status()
+            except requests.RequestException as e:
+                logging.warning(f"Failed to download {url}: {str(e)}")
+                continue
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(response.content)
+            logging.info(f"Downloaded {url} to {path}")
+
+def build_manifest(root, predecode=False):
+    """Describe every image under root/<emotion>/ and write manifest.json."""
+    templates = []
+    for path in sorted(root.glob('*/*')):
+        if path.suffix.lower() not in IMAGE_SUFFIXES:
+            continue
+        try:
+            frames, _ = decode_frames(path)
+        except Exception as e:
+            logging.warning(f"Skipping {path}: {str(e)}")
+            continue
+        first, _ = frames[0]
+        entry = {
+            'id': f"{path.parent.name}/{path.stem}",
+            'emotion': path.parent.name,
+            'file': path.relative_to(root).as_posix(),
+            'digest': hashlib.sha256(path.read_bytes()).hexdigest(),
+            'width': first.width,
+            'height': first.height,
+            'frames': len(frames),
+            'durations': [info['duration'] for _, info in frames],
+        }
+        if predecode:
+            predecoded = path.with_suffix(PREDECODED_SUFFIX)
+            entry['mode'] = write_predecoded(predecoded, frames)
+            entry['predecoded'] = predecoded.relative_to(root).as_posix()
+        templates.append(entry)
+
+    manifest_path = root / MANIFEST
+    temp = manifest_path.with_name(MANIFEST + '.tmp')
+    temp.write_text(json.dumps({'templates': templates}, indent=2), encoding='utf-8')
+    os.replace(temp, manifest_path)
+    return templates
+
+def main(argv=None):
+    """Build the manifest of a template library."""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('--dir', default=TEMPLATE_DIR, help="library directory, MEME_TEMPLATE_DIR by default")
+    parser.add_argument('--fetch', action='store_true', help="download the fallback memes into the library first")
+    parser.add_argument('--predecode', action='store_true', help="also write raw frames for MEME_TEMPLATE_MMAP")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    root = Path(args.dir)
+    root.mkdir(parents=True, exist_ok=True)
+    if args.fetch:
+        fetch_fallback_memes(root)
+    templates = build_manifest(root, args.predecode)
+    emotions = sorted({entry['emotion'] for entry in templates})
+    logging.info(f"Indexed {len(templates)} templates for {len(emotions)} emotions in {root}")
+    return 0 if templates else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
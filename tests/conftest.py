@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# The benchmark corpora double as regression corpora
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'benchmarks'))
@@ -0,0 +1,74 @@
+from pathlib import Path
+
+import pytest
+
+import fixtures
+from marathi_meme_generator import template_library
+from marathi_meme_generator.result_cache import ResultCache
+
+SOURCE = 'template://neutral/still'
+
+
+@pytest.fixture(scope='module')
+def client(tmp_path_factory):
+    """A client of the app, rendering from a one-template library."""
+    from fastapi.testclient import TestClient
+    from marathi_meme_generator import main
+
+    root = tmp_path_factory.mktemp('templates')
+    (root / 'neutral').mkdir()
+    (root / 'neutral' / 'still.png').write_bytes(fixtures.make_still((320, 240)))
+    template_library.build_manifest(root)
+
+    patch = pytest.MonkeyPatch()
+    # Render workers load the library from the environment
+    patch.setenv('MEME_TEMPLATE_DIR', str(root))
+    library = template_library.TemplateLibrary(root)
+    patch.setattr(main, 'get_template_library', lambda: library)
+    result_cache = ResultCache(spill_dir=tmp_path_factory.mktemp('results'))
+    patch.setattr(main, 'get_result_cache', lambda: result_cache)
+    with TestClient(main.app) as client:
+        client.result_cache = result_cache
+        yield client
+    patch.undo()
+
+
+def test_search_renders_an_explicit_source(client):
+    response = client.post('/search', json={'text': 'hello there', 'source_url': SOURCE})
+    assert response.status_code == 200
+    assert response.headers['content-type'] == 'image/png'
+    assert response.headers['X-Meme-Source'] == SOURCE
+    assert response.headers['Cache-Control'].startswith('public')
+    assert response.content.startswith(b'\x89PNG')
+
+
+def test_matching_etag_gets_304(client):
+    query = {'text': 'same caption', 'source_url': SOURCE}
+    first = client.post('/search', json=query)
+    etag = first.headers['ETag']
+
+    again = client.post('/search', json=query, headers={'If-None-Match': etag})
+    assert again.status_code == 304
+    assert again.headers['ETag'] == etag
+    assert again.content == b''
+
+    other = client.post('/search', json=query, headers={'If-None-Match': '"something else"'})
+    assert other.status_code == 200
+    assert other.content == first.content
+
+
+def test_unknown_source_is_rejected(client):
+    response = client.post('/search', json={'text': 'hi', 'source_url': 'https://example.com/x.gif'})
+    assert response.status_code == 400
+
+
+def test_crashed_worker_gets_503(client, monkeypatch):
+    from marathi_meme_generator.scheduler import WorkerCrashed
+
+    async def crash(*args, deadline=None):
+        raise WorkerCrashed(3)
+
+    monkeypatch.setattr(client.app.state.scheduler, 'run', crash)
+    response = client.post('/search', json={'text': 'a crash', 'source_url': SOURCE})
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '3'
@@ -0,0 +1,61 @@
+import json
+
+import pytest
+
+import fixtures
+from marathi_meme_generator import batch, giphy, template_library
+
+
+@pytest.fixture
+def library(tmp_path, monkeypatch):
+    """A one-template library, picked for every caption without Giphy."""
+    root = tmp_path / 'templates'
+    (root / 'neutral').mkdir(parents=True)
+    (root / 'neutral' / 'still.png').write_bytes(fixtures.make_still((160, 120)))
+    template_library.build_manifest(root)
+    # Render workers load the library from the environment
+    monkeypatch.setenv('MEME_TEMPLATE_DIR', str(root))
+    monkeypatch.delenv('GIPHY_API_KEY', raising=False)
+    library = template_library.TemplateLibrary(root)
+    monkeypatch.setattr(giphy, 'get_template_library', lambda: library)
+    return library
+
+
+def write_lines(path, lines):
+    path.write_text(''.join(line + '\n' for line in lines), encoding='utf-8')
+
+
+def test_read_manifest_skips_a_truncated_line(tmp_path):
+    manifest = tmp_path / batch.MANIFEST
+    manifest.write_text(
+        '{"id": "a", "status": "ok"}\n'
+        '{"id": "b", "status": "error", "error": "boom"}\n'
+        '{"id": "c", "sta',
+        encoding='utf-8'
+    )
+    assert batch.read_manifest(manifest) == {'a'}
+    assert batch.read_manifest(tmp_path / 'missing.jsonl') == set()
+
+
+def test_resume_skips_rendered_captions(tmp_path, library):
+    captions = tmp_path / 'captions.jsonl'
+    write_lines(captions, [json.dumps({'id': key, 'text': f"caption {key}"}) for key in 'abc'])
+    output = tmp_path / 'out'
+    output.mkdir()
+    manifest = output / batch.MANIFEST
+    # An earlier run finished a and was cut off while writing b
+    manifest.write_text('{"id": "a", "status": "ok", "file": "a.png"}\n{"id": "b", "sta', encoding='utf-8')
+
+    argv = [str(captions), '-o', str(output), '--workers', '1']
+    assert batch.main(argv) == 0
+    lines = manifest.read_text(encoding='utf-8').splitlines()
+    assert lines[1] == '{"id": "b", "sta'
+    entries = [json.loads(line) for line in lines[2:]]
+    assert sorted(entry['id'] for entry in entries) == ['b', 'c']
+    assert all(entry['status'] == 'ok' for entry in entries)
+    assert not (output / 'a.png').exists()
+    assert (output / 'b.png').exists() and (output / 'c.png').exists()
+
+    # Everything is rendered now, so a second run writes nothing
+    assert batch.main(argv) == 0
+    assert manifest.read_text(encoding='utf-8').splitlines() == lines
@@ -0,0 +1,90 @@
+import os
+import time
+
+from marathi_meme_generator.blob_cache import BlobCache
+
+
+class FakeResponse:
+    def __init__(self, status_code, content=b'', headers=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError(self.status_code)
+
+
+class FakeSession:
+    """Serves responses in order and remembers the headers of every request."""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def get(self, url, headers=None, timeout=None):
+        self.requests.append(headers or {})
+        return self.responses.pop(0)
+
+
+def _age(cache, url, seconds):
+    """Make url's blob look seconds older to eviction."""
+    path = cache._object_path(cache.lookup(url)['digest'])
+    then = time.time() - seconds
+    os.utime(path, (then, then))
+
+
+def test_eviction_removes_least_recently_used_blobs_and_their_records(tmp_path):
+    cache = BlobCache(tmp_path, max_bytes=250, scan_interval=3600)
+    cache.store('http://a/1', b'1' * 100, {})
+    _age(cache, 'http://a/1', 30)
+    cache.store('http://a/2', b'2' * 100, {})
+    _age(cache, 'http://a/2', 20)
+    cache.store('http://a/3', b'3' * 100, {})
+
+    assert cache.lookup('http://a/1') is None
+    assert cache.lookup('http://a/2') is not None
+    assert cache.lookup('http://a/3') is not None
+    assert not cache._record_path('http://a/1').exists()
+    assert cache.stats()['evictions'] == 1
+
+
+def test_store_only_scans_when_over_budget_or_due(tmp_path, monkeypatch):
+    cache = BlobCache(tmp_path, max_bytes=10_000, scan_interval=3600)
+    scans = []
+    evict = cache.evict
+    monkeypatch.setattr(cache, 'evict', lambda: scans.append(1) or evict())
+
+    for index in range(20):
+        cache.store(f'http://a/{index}', bytes([index]) * 100, {})
+    # The first store learns the size of the cache, the rest keep count
+    assert len(scans) == 1
+
+    cache.store('http://a/big', b'x' * 10_000, {})
+    assert len(scans) == 2
+    assert cache.lookup('http://a/big') is not None
+    assert cache.lookup('http://a/0') is None
+
+
+def test_revalidation_keeps_the_same_blob(tmp_path):
+    cache = BlobCache(tmp_path)
+    session = FakeSession(
+        FakeResponse(200, b'gif bytes', {'ETag': '"v1"', 'Cache-Control': 'no-cache'}),
+        FakeResponse(304, headers={'Cache-Control': 'max-age=60'}),
+    )
+    first = cache.fetch('http://a/meme.gif', session=session)
+    digest = cache.lookup('http://a/meme.gif')['digest']
+    assert bytes(first[:]) == b'gif bytes'
+
+    second = cache.fetch('http://a/meme.gif', session=session)
+    assert bytes(second[:]) == b'gif bytes'
+    assert session.requests[1]['If-None-Match'] == '"v1"'
+    record = cache.lookup('http://a/meme.gif')
+    assert record['digest'] == digest and record['etag'] == '"v1"'
+    assert cache.is_fresh(record)
+    assert cache.stats()['revalidated'] == 1
+
+    # Fresh now, so served without a request
+    cache.fetch('http://a/meme.gif', session=session)
+    assert len(session.requests) == 2
+    assert cache.stats()['hits'] == 1
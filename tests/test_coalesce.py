@@ -0,0 +1,129 @@
+import asyncio
+import threading
+
+import pytest
+
+from marathi_meme_generator.coalesce import SingleFlight
+
+
+class Work:
+    """Counts its runs; each waits for release and returns the run number."""
+
+    def __init__(self, error=None):
+        self.runs = 0
+        self.error = error
+        self.started = asyncio.Event()
+        self.release = asyncio.Event()
+
+    async def __call__(self):
+        self.runs += 1
+        self.started.set()
+        run = self.runs
+        await self.release.wait()
+        if self.error is not None:
+            raise self.error
+        return run
+
+
+def test_concurrent_runs_share_one_call():
+    async def main():
+        flights = SingleFlight('test', lock_dir='')
+        work = Work()
+        waiters = [asyncio.ensure_future(flights.run('key', work)) for _ in range(5)]
+        await asyncio.sleep(0)
+        work.release.set()
+        return await asyncio.gather(*waiters), work.runs, flights.stats()
+
+    results, runs, stats = asyncio.run(main())
+    assert results == [1] * 5
+    assert runs == 1
+    assert stats == {'leaders': 1, 'coalesced': 4, 'cross_process': 0, 'in_flight': 0}
+
+
+def test_errors_reach_every_waiter_and_are_not_remembered():
+    async def main():
+        flights = SingleFlight('test', lock_dir='')
+        work = Work(ValueError("no memes"))
+        waiters = [asyncio.ensure_future(flights.run('key', work)) for _ in range(3)]
+        await asyncio.sleep(0)
+        work.release.set()
+        results = await asyncio.gather(*waiters, return_exceptions=True)
+        assert all(isinstance(result, ValueError) for result in results)
+
+        work.error = None
+        assert await flights.run('key', work) == 2
+
+    asyncio.run(main())
+
+
+def test_cancelled_waiter_leaves_the_run_to_the_others():
+    async def main():
+        flights = SingleFlight('test', lock_dir='')
+        work = Work()
+        leaving = asyncio.ensure_future(flights.run('key', work))
+        staying = asyncio.ensure_future(flights.run('key', work))
+        await asyncio.sleep(0)
+        leaving.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leaving
+        work.release.set()
+        assert await staying == 1
+        assert work.runs == 1
+
+    asyncio.run(main())
+
+
+def test_cancelled_run_is_retried_by_its_waiters():
+    async def main():
+        flights = SingleFlight('test', lock_dir='')
+        work = Work()
+        waiter = asyncio.ensure_future(flights.run('key', work))
+        await work.started.wait()
+        flights._tasks['key'].cancel()
+        work.release.set()
+        assert await waiter == 2
+
+    asyncio.run(main())
+
+
+def test_waiter_cancelled_with_the_run_stays_cancelled():
+    async def main():
+        flights = SingleFlight('test', lock_dir='')
+        work = Work()
+        waiter = asyncio.ensure_future(flights.run('key', work))
+        await work.started.wait()
+        flights._tasks['key'].cancel()
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert work.runs == 1
+        assert flights.stats()['in_flight'] == 0
+
+    asyncio.run(main())
+
+
+def test_threads_share_one_call():
+    flights = SingleFlight('test', lock_dir='')
+    started = threading.Event()
+    release = threading.Event()
+    runs = []
+
+    def work():
+        runs.append(1)
+        started.set()
+        release.wait()
+        return len(runs)
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flights.call('key', work)))
+    leader.start()
+    started.wait()
+    follower = threading.Thread(target=lambda: results.append(flights.call('key', work)))
+    follower.start()
+    while flights.stats()['coalesced'] == 0:
+        threading.Event().wait(0.001)
+    release.set()
+    leader.join()
+    follower.join()
+    assert results == [1, 1]
+    assert len(runs) == 1
@@ -0,0 +1,72 @@
+"""Importing the Streamlit app stays fast and free of side effects.
+
+Each probe imports the app in a fresh interpreter, with its third-party
+dependencies already imported (as they are when Streamlit re-runs the
+script) and the network blocked.
+"""
+import os
+import sys
+import json
+import tempfile
+import subprocess
+from pathlib import Path
+
+import pytest
+
+MODULE = 'marathi_meme_generator.streamlit_app'
+SRC = Path(__file__).resolve().parents[1] / 'src'
+BUDGET_MS = 100
+REPEAT = 5
+# Loaded on first use only, never by the import
+LAZY_MODULES = ('nltk', 'giphy_client')
+
+PROBE = f"""
+import sys, json, time, socket
+
+def refuse(*args, **kwargs):
+    raise RuntimeError('import tried to use the network')
+socket.socket.connect = refuse
+
+import PIL.Image, dotenv, requests, streamlit
+
+start = time.perf_counter()
+import {MODULE}
+elapsed = time.perf_counter() - start
+print(json.dumps({{
+    'ms': 1000 * elapsed,
+    'loaded': [name for name in {LAZY_MODULES!r} if name in sys.modules],
+}}))
+"""
+
+
+def measure():
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [str(SRC), os.getenv('PYTHONPATH')])))
+    # A scratch working directory shows any file the import creates
+    with tempfile.TemporaryDirectory() as cwd:
+        result = subprocess.run(
+            [sys.executable, '-c', PROBE], cwd=cwd, env=env, capture_output=True, text=True
+        )
+        assert result.returncode == 0, f"Importing {MODULE} failed:\n{result.stderr}"
+        probe = json.loads(result.stdout.splitlines()[-1])
+        probe['created'] = sorted(path.name for path in Path(cwd).iterdir())
+    return probe
+
+
+@pytest.fixture(scope='module')
+def probes():
+    return [measure() for _ in range(REPEAT)]
+
+
+def test_import_is_within_budget(probes):
+    best = min(probe['ms'] for probe in probes)
+    assert best <= BUDGET_MS, f"import took {best:.1f} ms, over the {BUDGET_MS} ms budget"
+
+
+def test_import_loads_nothing_lazy(probes):
+    for probe in probes:
+        assert probe['loaded'] == []
+
+
+def test_import_creates_no_files(probes):
+    for probe in probes:
+        assert probe['created'] == []
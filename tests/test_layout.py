@@ -0,0 +1,104 @@
+"""The cached-metrics wrapping and binary size search lay captions out
+exactly as the textbbox wrapping and linear size search they replaced."""
+import pytest
+from PIL import Image, ImageDraw
+
+from corpora import CORPORA
+from marathi_meme_generator import layout
+
+WIDTHS = (240, 480, 800, 1280)
+CAPTIONS = 40
+
+
+def baseline_wrap_text(text, width, font, draw):
+    words = text.split()
+    lines = []
+    current_line = []
+
+    for word in words:
+        current_line.append(word)
+        test_line = ' '.join(current_line)
+        bbox = draw.textbbox((0, 0), test_line, font=font)
+        text_width = bbox[2] - bbox[0]
+
+        if text_width > width:
+            if len(current_line) > 1:
+                current_line.pop()
+                lines.append(' '.join(current_line))
+                current_line = [word]
+            else:
+                lines.append(word)
+                current_line = []
+
+    if current_line:
+        lines.append(' '.join(current_line))
+
+    return '\n'.join(lines)
+
+def baseline_calculate_optimal_font_size(draw, text, image_width, image_height, border_height):
+    word_count = len(text.split())
+    char_count = len(text)
+
+    if word_count <= 3 and char_count <= 15:
+        max_size = min(60, border_height // 3)
+    elif word_count <= 6 and char_count <= 30:
+        max_size = min(45, border_height // 3)
+    else:
+        max_size = min(35, border_height // 3)
+
+    min_size = 20
+    current_size = max_size
+
+    while current_size >= min_size:
+        font = layout.get_font(text, current_size)
+        wrapped_text = baseline_wrap_text(text, image_width * 0.85, font, draw)
+        num_lines = wrapped_text.count('\n') + 1
+        line_spacing = current_size // 4
+        total_text_height = (current_size * num_lines) + (line_spacing * (num_lines - 1))
+
+        bbox = draw.multiline_textbbox((0, 0), wrapped_text, font=font, align='center', spacing=line_spacing)
+        text_width = bbox[2] - bbox[0]
+        text_height = bbox[3] - bbox[1]
+
+        if (text_width <= image_width * 0.85 and
+            text_height <= border_height * 0.85 and
+            total_text_height <= border_height * 0.85):
+            return font, text_width, text_height, wrapped_text, line_spacing
+
+        current_size -= 2
+
+    font = layout.get_font(text, min_size)
+    wrapped_text = baseline_wrap_text(text, image_width * 0.85, font, draw)
+    bbox = draw.multiline_textbbox((0, 0), wrapped_text, font=font, align='center')
+    line_spacing = min_size // 4
+    return font, bbox[2] - bbox[0], bbox[3] - bbox[1], wrapped_text, line_spacing
+
+
+def _describe(result):
+    font, text_width, text_height, wrapped_text, line_spacing = result
+    return font.size, text_width, text_height, wrapped_text, line_spacing
+
+
+@pytest.fixture(scope='module')
+def draw():
+    return ImageDraw.Draw(Image.new('RGB', (1, 1)))
+
+
+@pytest.mark.parametrize('corpus', sorted(CORPORA))
+@pytest.mark.parametrize('width', WIDTHS)
+def test_wrap_text_matches_baseline(draw, corpus, width):
+    for text in CORPORA[corpus](CAPTIONS, seed=width):
+        for size in (20, 36, 60):
+            font = layout.get_font(text, size)
+            assert layout.wrap_text(text, width * 0.85, font) == baseline_wrap_text(text, width * 0.85, font, draw), text
+
+
+@pytest.mark.parametrize('corpus', sorted(CORPORA))
+@pytest.mark.parametrize('width', WIDTHS)
+def test_font_size_matches_baseline(draw, corpus, width):
+    height = width * 3 // 4
+    border_height = int(height * 0.20)
+    for text in CORPORA[corpus](CAPTIONS, seed=width):
+        expected = baseline_calculate_optimal_font_size(draw, text, width, height, border_height)
+        actual = layout.calculate_optimal_font_size(draw, text, width, height, border_height)
+        assert _describe(actual) == _describe(expected), text
@@ -0,0 +1,83 @@
+"""The compiled lexicon labels captions exactly as the word-by-word
+matching it replaced."""
+import random
+
+import pytest
+
+from corpora import CORPORA
+from marathi_meme_generator import sentiment
+
+CAPTIONS = 2000
+
+
+@pytest.fixture(scope='module')
+def baseline():
+    emotions_data = sentiment.load_emotions()
+    marathi_emotions = {emotion: set(words) for emotion, words in emotions_data.items() if emotion != 'phrases'}
+    emotion_phrases = emotions_data.get('phrases', {})
+
+    def is_marathi_transcript(text):
+        words = set(text.lower().split())
+        marathi_word_count = len(words.intersection(marathi_emotions['roast']))
+        return marathi_word_count / len(words) > 0.2 if words else False
+
+    def detect_emotion(text):
+        text_lower = text.lower()
+        words = text_lower.split()
+
+        for roast_word in marathi_emotions['roast']:
+            if any(roast_word in word for word in words):
+                return 'roast'
+
+        if any('qt' in word or 'cute' in word for word in words):
+            return 'flirt'
+
+        for emotion, phrases in emotion_phrases.items():
+            if any(phrase in text_lower for phrase in phrases):
+                return emotion
+
+        if ('khup' in words or 'khoop' in words) and ('cute' in words or 'qt' in words):
+            return 'flirt'
+
+        emotion_counts = {}
+        for emotion, word_set in marathi_emotions.items():
+            count = 0
+            for word in words:
+                matches = sum(1 for emotion_word in word_set if emotion_word in word)
+                count += matches
+            if count > 0:
+                emotion_counts[emotion] = count
+
+        return max(emotion_counts.items(), key=lambda x: x[1])[0] if emotion_counts else 'neutral'
+
+    return detect_emotion, is_marathi_transcript
+
+
+def _corpus(name):
+    captions = CORPORA[name](CAPTIONS, seed=7)
+    rng = random.Random(7)
+    # Case and spacing variants of the same captions
+    captions += [caption.upper() for caption in captions[:200]]
+    captions += [caption.title() for caption in captions[:200]]
+    captions += [f"  {caption.replace(' ', rng.choice(['  ', chr(9), ' ']))} " for caption in captions[:200]]
+    return captions
+
+
+@pytest.mark.parametrize('corpus', sorted(CORPORA))
+def test_detect_emotion_matches_baseline(baseline, corpus):
+    detect_emotion, _ = baseline
+    for text in _corpus(corpus):
+        assert sentiment.detect_emotion(text) == detect_emotion(text), text
+
+
+@pytest.mark.parametrize('corpus', sorted(CORPORA))
+def test_is_marathi_transcript_matches_baseline(baseline, corpus):
+    _, is_marathi_transcript = baseline
+    for text in _corpus(corpus):
+        assert sentiment.is_marathi_transcript(text) == is_marathi_transcript(text), text
+
+
+def test_labels_are_not_all_neutral():
+    # A lexicon that failed to load would agree with a baseline that did too
+    labels = {sentiment.detect_emotion(text) for text in _corpus('transliterated')}
+    assert len(labels - {'neutral'}) >= 3
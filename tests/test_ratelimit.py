@@ -0,0 +1,121 @@
+import pytest
+
+import fixtures
+from stub import StubServer
+from marathi_meme_generator import giphy
+from marathi_meme_generator.ratelimit import CircuitBreaker, GiphyGate, GiphyUnavailable, TokenBucket
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_bucket_refills_at_its_rate():
+    clock = Clock()
+    bucket = TokenBucket(rate=0.5, capacity=2, clock=clock)
+    assert bucket.try_take() and bucket.try_take()
+    assert not bucket.try_take()
+
+    clock.now = 1.0
+    assert not bucket.available()
+    clock.now = 2.0
+    assert bucket.try_take()
+    # Never more than the capacity, however long it sat idle
+    clock.now = 100.0
+    assert bucket.tokens() == 2
+
+    # A server's Retry-After holds off the refill
+    bucket.drain(retry_after=10)
+    clock.now = 109.0
+    assert bucket.tokens() == 0
+    clock.now = 112.0
+    assert bucket.try_take()
+
+
+def test_breaker_opens_probes_and_closes():
+    clock = Clock()
+    breaker = CircuitBreaker(failure_threshold=2, cooldown=10, max_cooldown=30, clock=clock)
+    breaker.failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+    # After the cooldown a single probe goes through
+    clock.now = 10.0
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow()
+
+    # A failed probe opens the circuit for twice as long
+    breaker.failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    clock.now = 29.0
+    assert not breaker.ready()
+    clock.now = 30.0
+    assert breaker.allow()
+
+    breaker.success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow() and breaker.allow()
+    assert breaker.stats()['opened'] == 2
+
+
+def test_breaker_cooldown_is_capped():
+    clock = Clock()
+    breaker = CircuitBreaker(failure_threshold=1, cooldown=10, max_cooldown=15, clock=clock)
+    breaker.failure()
+    for _ in range(3):
+        clock.now += 15
+        assert breaker.allow()
+        breaker.failure()
+    assert breaker.stats()['open_for'] == 15
+
+
+@pytest.fixture
+def server(monkeypatch):
+    """A GIPHY stand-in that allows two searches an hour."""
+    images = {'meme.gif': ('image/gif', fixtures.make_animation(2, (32, 32)))}
+    server = StubServer(images, quota=2).start()
+    monkeypatch.setattr(giphy, 'GIPHY_SEARCH_URL', server.url('/v1/gifs/search'))
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def search_many(gate, count):
+    reasons = []
+    for number in range(count):
+        try:
+            gate.call(giphy._search_giphy, f"term {number}", 'g')
+            reasons.append('ok')
+        except GiphyUnavailable as e:
+            reasons.append(e.reason)
+    return reasons
+
+
+def test_ungated_searches_get_429s(server):
+    # No limit and a breaker that never opens: every search reaches the server
+    gate = GiphyGate(TokenBucket(0, 0), CircuitBreaker(failure_threshold=100))
+    assert search_many(gate, 4) == ['ok'] * 2 + ['rate_limited'] * 2
+    assert server.searches == 4
+
+
+def test_bucket_keeps_searches_within_the_quota(server):
+    clock = Clock()
+    gate = GiphyGate(TokenBucket(2 / 3600, 2, clock=clock), CircuitBreaker(clock=clock))
+    assert search_many(gate, 10) == ['ok'] * 2 + ['quota'] * 8
+    # Refused searches never reached the server, so it never answered 429
+    assert server.searches == 2
+
+
+def test_breaker_stops_searches_after_a_429(server):
+    clock = Clock()
+    # A bucket larger than the quota, as when another process used it up
+    gate = GiphyGate(TokenBucket(100 / 3600, 100, clock=clock), CircuitBreaker(failure_threshold=1, clock=clock))
+    assert search_many(gate, 10) == ['ok'] * 2 + ['rate_limited'] + ['circuit_open'] * 7
+    assert server.searches == 3
@@ -0,0 +1,28 @@
+from marathi_meme_generator.result_cache import ResultCache, make_etag
+
+
+def test_spilled_results_reload_from_disk(tmp_path):
+    cache = ResultCache(max_bytes=100, spill_dir=tmp_path)
+    first = cache.put('first', b'1' * 80, 'image/gif')
+    cache.put('second', b'2' * 80, 'image/png')
+
+    # Pushed out of memory by the second result, so only on disk now
+    assert cache.peek('first') is None
+    assert cache.stats()['spilled'] == 1
+
+    reloaded = cache.get('first')
+    assert reloaded == first
+    assert reloaded.etag == make_etag(b'1' * 80)
+    assert cache.stats()['disk_hits'] == 1
+    # Back in memory, and the second result spilled in turn
+    assert cache.peek('first') == first
+    assert cache.peek('second') is None
+    assert cache.get('second').media_type == 'image/png'
+
+
+def test_missing_results(tmp_path):
+    cache = ResultCache(max_bytes=100, spill_dir=tmp_path)
+    assert cache.peek('missing') is None
+    assert cache.get('missing') is None
+    assert cache.stats()['misses'] == 1
+    assert ResultCache(spill_dir=None).get('missing') is None
@@ -0,0 +1,79 @@
+import os
+import time
+import signal
+import asyncio
+
+import pytest
+
+from marathi_meme_generator.scheduler import DeadlineExceeded, Overloaded, RenderScheduler, WorkerCrashed
+
+
+def run_with_scheduler(test, workers=1, max_queue=1):
+    async def main():
+        scheduler = RenderScheduler(workers, max_queue)
+        try:
+            return await test(scheduler)
+        finally:
+            scheduler.shutdown()
+    return asyncio.run(main())
+
+
+def test_full_queue_is_refused():
+    async def test(scheduler):
+        running = asyncio.ensure_future(scheduler.run(time.sleep, 0.5))
+        await asyncio.sleep(0)
+        queued = asyncio.ensure_future(scheduler.run(os.getpid))
+        await asyncio.sleep(0)
+        with pytest.raises(Overloaded) as refused:
+            await scheduler.run(os.getpid)
+        assert refused.value.retry_after >= 1
+        await asyncio.gather(running, queued)
+        return scheduler.stats()
+
+    stats = run_with_scheduler(test)
+    assert stats['rejected'] == 1
+    assert stats['completed'] == 2
+
+
+def test_deadline_passes_while_waiting():
+    async def test(scheduler):
+        running = asyncio.ensure_future(scheduler.run(time.sleep, 0.5))
+        await asyncio.sleep(0)
+        with pytest.raises(DeadlineExceeded):
+            await scheduler.run(os.getpid, deadline=time.monotonic() + 0.05)
+        await running
+        return scheduler.stats()
+
+    stats = run_with_scheduler(test)
+    assert stats['expired'] == 1
+    assert stats['queued'] == 0
+
+
+def test_deadline_passes_while_rendering():
+    async def test(scheduler):
+        with pytest.raises(DeadlineExceeded):
+            await scheduler.run(time.sleep, 1, deadline=time.monotonic() + 0.1)
+        # The worker is still taken until the job ends
+        assert scheduler.stats()['running'] == 1
+
+    run_with_scheduler(test)
+
+
+def test_crashed_worker_is_replaced():
+    async def test(scheduler):
+        worker = await scheduler.run(os.getpid)
+        render = asyncio.ensure_future(scheduler.run(time.sleep, 5))
+        await asyncio.sleep(0.2)
+        os.kill(worker, signal.SIGKILL)
+        with pytest.raises(WorkerCrashed) as crashed:
+            await render
+        assert crashed.value.retry_after >= 1
+
+        # The next render gets a fresh worker
+        assert await scheduler.run(os.getpid) != worker
+        return scheduler.stats()
+
+    stats = run_with_scheduler(test)
+    assert stats['restarts'] == 1
+    assert stats['failed'] == 1
+    assert stats['running'] == 0
@@ -0,0 +1,31 @@
+"""analyze_sentiment_batch labels captions exactly as analyze_sentiment does."""
+import random
+
+from corpora import CORPORA
+from marathi_meme_generator import sentiment
+
+EMPHASIS = ['wow', 'BAD', 'FINE', 'no', 'GREAT', 'not', 'very', 'Good', 'HATE', 'love', '!!!', ':)', ':(']
+
+
+def _mixed_case_corpus(count=3000, seed=11):
+    rng = random.Random(seed)
+    captions = []
+    for name, corpus in sorted(CORPORA.items()):
+        for caption in corpus(count // len(CORPORA), seed=seed):
+            words = caption.split() + rng.sample(EMPHASIS, 2)
+            rng.shuffle(words)
+            words = [word.upper() if rng.random() < 0.3 else word for word in words]
+            captions.append(' '.join(words) + rng.choice(['', '!', '!!!', '?']))
+    captions += ["wow BAD!!!", "wow bad!!!", "no FINE", "no fine", "  no   FINE "]
+    # Duplicates in other forms, as batches repeat captions
+    captions += [caption.lower() for caption in captions[::7]]
+    captions += [f"  {caption}  " for caption in captions[::5]]
+    return captions
+
+
+def test_batch_matches_analyze_sentiment():
+    texts = _mixed_case_corpus()
+    expected = [sentiment.analyze_sentiment(text) for text in texts]
+    assert sentiment.analyze_sentiment_batch(texts) == expected
+    # Served from the result cache the second time
+    assert sentiment.analyze_sentiment_batch(texts) == expected